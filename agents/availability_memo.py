@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dateutil import parser as date_parser
+import dotenv
+
+from .calendar_cache import events_cache
+from .traffic import cache_ttl
+
+dotenv.load_dotenv()
+
+def _normalize_date(value: str) -> str:
+    try:
+        return date_parser.parse(value).date().isoformat()
+    except (ValueError, OverflowError):
+        return value.strip().lower()
+
+
+def _normalize_time(value: str) -> str:
+    try:
+        return date_parser.parse(value).strftime("%H:%M")
+    except (ValueError, OverflowError):
+        return value.strip().lower()
+
+
+class AvailabilityMemo:
+    def __init__(self, ttl=120.0, max_entries=1024):
+        """
+        Remember the outcome of availability checks, so asking again for the
+        same window is answered without running the agent or calling the API.
+
+        Args:
+            ttl (float): Seconds an outcome is reused, 0 disables the memo
+            max_entries (int): Maximum number of remembered windows
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, str | None]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(calendar_id: str, desired) -> tuple:
+        """Cache key of a DesiredAppointment on a calendar"""
+        return (
+            calendar_id,
+            _normalize_date(desired.min_date),
+            _normalize_date(desired.max_date),
+            _normalize_time(desired.time),
+        )
+
+    def get(self, key: tuple) -> tuple[bool, str | None]:
+        """
+        Returns:
+            tuple: Whether the window is remembered, and the selected event ID
+        """
+        if self.ttl <= 0:
+            return False, None
+        # Writes made by other processes invalidate this memo through the events cache
+        events_cache.sync(key[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def put(self, key: tuple, slot_id: str | None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, slot_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, calendar_id: str):
+        """Forget every outcome of a calendar, e.g. after a booking was written"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == calendar_id]:
+                del self._entries[key]
+
+
+availability_memo = AvailabilityMemo(
+    ttl=cache_ttl("AVAILABILITY_MEMO_TTL", "120"),
+    max_entries=int(os.getenv("AVAILABILITY_MEMO_MAX_ENTRIES", "1024")),
+)
+# Bookings and push notifications invalidate the events cache of the calendar
+events_cache.add_invalidation_listener(availability_memo.invalidate)
@@ -0,0 +1,227 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+import dotenv
+import logfire
+
+from .run_context import bind_run_context
+from .sqlite_db import SqliteDatabase
+from .tenants import manager_pool
+
+dotenv.load_dotenv()
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    thread_id TEXT,
+    tenant_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookings_due ON bookings (status, next_attempt_at);
+"""
+
+
+class BookingOutbox:
+    def __init__(self, path='./booking_outbox.sqlite3', workers=2, max_attempts=8,
+                 base_delay=1.0, max_delay=60.0, poll_interval=1.0, claim_timeout=300.0):
+        """
+        Durable write-behind queue for booking updates. Intents are committed to
+        SQLite and acknowledged immediately; background workers apply them to
+        Google Calendar with retries.
+
+        Args:
+            path (str): SQLite database file
+            workers (int): Number of worker threads
+            max_attempts (int): Attempts before a booking is marked as failed
+            base_delay (float): First retry delay in seconds
+            max_delay (float): Upper bound for a retry delay in seconds
+            poll_interval (float): Seconds idle workers wait before checking again
+            claim_timeout (float): Seconds after which a claimed booking whose worker
+                stopped is claimed again
+        """
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self._listeners: list[Callable[[dict], None]] = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._db = SqliteDatabase(path, _SCHEMA, synchronous=None, row_factory=sqlite3.Row)
+
+    def enqueue(self, idempotency_key: str, tenant_id: str, event_id: str, payload: dict,
+                thread_id: str | None = None) -> dict:
+        """
+        Durably record a booking intent. Enqueueing the same key twice
+        returns the existing booking instead of creating a new one, unless
+        that booking failed: then it is queued again with the new payload.
+
+        Args:
+            idempotency_key (str): Unique key of the booking
+            tenant_id (str): Tenant whose calendar holds the event
+            event_id (str): "Available" event to book
+            payload (dict): Keyword arguments for GoogleCalendarManager.update_event
+            thread_id (str): Conversation to notify with the outcome (optional)
+
+        Returns:
+            dict: The booking row
+        """
+        now = time.time()
+        self._db.conn.execute(
+            "INSERT INTO bookings (idempotency_key, thread_id, tenant_id, event_id, payload,"
+            " status, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (idempotency_key) DO UPDATE SET payload = excluded.payload, status = excluded.status,"
+            " attempts = 0, result = NULL, error = NULL, next_attempt_at = excluded.next_attempt_at,"
+            " updated_at = excluded.updated_at WHERE bookings.status = ?",
+            (idempotency_key, thread_id, tenant_id, event_id, json.dumps(payload), PENDING, now, now, now, FAILED),
+        )
+        self._wakeup.set()
+        return self.get(idempotency_key)
+
+    def get(self, idempotency_key: str) -> dict | None:
+        row = self._db.conn.execute(
+            "SELECT * FROM bookings WHERE idempotency_key = ?", (idempotency_key,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def bookings_for_thread(self, thread_id: str) -> list[dict]:
+        rows = self._db.conn.execute(
+            "SELECT * FROM bookings WHERE thread_id = ? ORDER BY id", (thread_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """Call `listener(booking)` once a booking is done or has failed"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """
+        Start the worker threads. Bookings interrupted by a restart are claimed
+        again once their claim expires, so bookings being applied by another
+        process are left alone.
+        """
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"booking-outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _claim(self) -> dict | None:
+        # An in-progress booking's next_attempt_at is the expiry of its claim
+        now = time.time()
+        with self._db.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM bookings WHERE status IN (?, ?) AND next_attempt_at <= ?"
+                " ORDER BY next_attempt_at LIMIT 1",
+                (PENDING, IN_PROGRESS, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE bookings SET status = ?, attempts = attempts + 1, next_attempt_at = ?, updated_at = ?"
+                    " WHERE id = ?",
+                    (IN_PROGRESS, now + self.claim_timeout, now, row["id"]),
+                )
+        if row is None:
+            return None
+        booking = dict(row)
+        booking["attempts"] += 1
+        return booking
+
+    def _work(self):
+        while not self._stop.is_set():
+            booking = self._claim()
+            if booking is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._apply(booking)
+
+    def _apply(self, booking: dict):
+        context = {"configurable": {"thread_id": booking["thread_id"], "tenant_id": booking["tenant_id"]}}
+        try:
+            with bind_run_context(context), manager_pool.lease(booking["tenant_id"]) as calendar_manager:
+                event = calendar_manager.update_event(
+                    event_id=booking["event_id"],
+                    booking_key=booking["idempotency_key"],
+                    **json.loads(booking["payload"])
+                )
+        except Exception as e:
+            if booking["attempts"] >= self.max_attempts or "already booked" in str(e):
+                self._finish(booking, FAILED, error=str(e))
+                return
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** booking["attempts"]))
+            logfire.warn("Booking {key} failed, retrying in {delay:.1f}s: {error}",
+                         key=booking["idempotency_key"], delay=delay, error=str(e))
+            self._db.conn.execute(
+                "UPDATE bookings SET status = ?, error = ?, next_attempt_at = ?, updated_at = ?"
+                " WHERE id = ? AND attempts = ?",
+                (PENDING, str(e), time.time() + delay, time.time(), booking["id"], booking["attempts"]),
+            )
+            return
+        self._finish(booking, DONE, result=event)
+
+    def _finish(self, booking: dict, status: str, result: dict | None = None, error: str | None = None):
+        # A worker whose claim expired and was taken over leaves the outcome to the new claim
+        finished = self._db.conn.execute(
+            "UPDATE bookings SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ? AND attempts = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(),
+             booking["id"], booking["attempts"]),
+        ).rowcount
+        if not finished:
+            return
+        booking = self.get(booking["idempotency_key"])
+        for listener in self._listeners:
+            try:
+                listener(booking)
+            except Exception as e:
+                logfire.error("Booking listener failed: {error}", error=str(e))
+
+
+def booking_status(booking: dict) -> dict:
+    """Outcome of a finished booking in the shape shown to the user"""
+    result = json.loads(booking["result"]) if booking["result"] else {}
+    return {
+        "status": booking["status"],
+        "event_id": booking["event_id"],
+        "link": result.get("link") or "",
+        "error": booking["error"] or "",
+    }
+
+
+booking_outbox = BookingOutbox(
+    path=os.getenv("BOOKING_OUTBOX_PATH", "./booking_outbox.sqlite3"),
+    workers=int(os.getenv("BOOKING_OUTBOX_WORKERS", "2")),
+    max_attempts=int(os.getenv("BOOKING_OUTBOX_MAX_ATTEMPTS", "8")),
+    claim_timeout=float(os.getenv("BOOKING_OUTBOX_CLAIM_TIMEOUT", "300")),
+)
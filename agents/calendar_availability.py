@@ -8,27 +8,34 @@ import logfire
 from .model import get_model
 import dotenv
 from .google_calendar_manager import GoogleCalendarManager, GoogleEvent
-from datetime import datetime, date, time
+from .tenants import business_zone, manager_pool
+from .slot_leases import slot_leases
+from .run_context import current_thread_id
+from .deadlines import with_tool_deadline
+from datetime import datetime, date, time, timedelta, timezone
+from typing import AsyncIterator
+import asyncio
+from langgraph.config import get_stream_writer
 
 dotenv.load_dotenv()
 logfire.configure(token=os.getenv("LOGFIRE_API_KEY"))
 logfire.instrument_pydantic_ai()
 
-@dataclass
+@dataclass(slots=True)
 class DesiredAppointment:
     min_date: str
     max_date: str
     time: str
 
-@dataclass
+@dataclass(slots=True)
 class SelectedAppointment:
     id: str
 
-@dataclass
+@dataclass(slots=True)
 class NoAvailableSlots:
     message: str
 
-model = get_model()
+model = get_model("calendar_availability")
 # Look for alternatives to show the appointment confirmation
 prompt = """
 Role: Intelligent Calendar Availability Assistant
@@ -52,7 +59,11 @@ User Interaction Flow:
        → Respond: "No slots open at [date/time]. Would you like to check another time or list available slots?"
        → Return None.
 
-2. If the appointment is found proceed and return the appointment details in the required format output.
+2. If the user asks to list open slots over several days (e.g. "next week"):
+   - Use search_available_slots_tool with the first and last day of the range.
+   - The open slots are shown to the user day by day while the search runs, do not repeat them all.
+
+3. If the appointment is found proceed and return the appointment details in the required format output.
 
 Output
 Return the ID of the selected appointment. in the required format
@@ -61,26 +72,30 @@ Return the ID of the selected appointment. in the required format
 
 calendar_availability_agent = Agent[DesiredAppointment, SelectedAppointment](model=model, system_prompt=prompt, output_type=SelectedAppointment)
 
-calendar_manager = GoogleCalendarManager(
-        service_account_file='./client_secrets.json',
-        calendar_id=os.getenv("CALENDAR_ID", "primary")
-    )
+def _upcoming_events() -> list:
+    with manager_pool.lease() as calendar_manager:
+        events = calendar_manager.get_events(max_results=5)
+    # Slots held by other conversations are not offered
+    return slot_leases.filter_available(events, holder=current_thread_id.get())
 
 # Handle pass down the date and time from the user to the calendar manager
 @calendar_availability_agent.tool
+@with_tool_deadline
 async def get_calendar_tool(ctx: RunContext[None], date: str, time: str) -> str:
     """
     Suggest the next available time slot if the desired slot is not available.
     
     """
 
-    events = calendar_manager.get_events(max_results=5)
+    # Calendar calls are blocking, keep them off the event loop so the deadline applies
+    events = await manager_pool.call(_upcoming_events)
 
     # logfire.info(f"Found events: {events}")
     # Placeholder for actual logic to find the next available slot
     return json.dumps(events, indent=2)
 
 @calendar_availability_agent.tool
+@with_tool_deadline
 async def get_availability_tool(ctx: RunContext[None], date: str, time: str) -> str:
     """
     Display all the next available spots, if exist some
@@ -88,7 +103,8 @@ async def get_availability_tool(ctx: RunContext[None], date: str, time: str) ->
     """
     print(f"Checking availability for {date} at {time}")
 
-    events = calendar_manager.get_events(max_results=5)
+    # Calendar calls are blocking, keep them off the event loop so the deadline applies
+    events = await manager_pool.call(_upcoming_events)
     print (f"Found events: {events}")
 
     # logfire.info(f"Found events: {events}")
@@ -96,6 +112,79 @@ async def get_availability_tool(ctx: RunContext[None], date: str, time: str) ->
     return json.dumps(events, indent=2)
 
 
+SEARCH_MAX_DAYS = int(os.getenv("SEARCH_MAX_DAYS", "31"))
+
+
+def _day_slots(day: date, holder: str | None) -> list:
+    # Days run from midnight to midnight in the business's time zone
+    zone = business_zone()
+    day_start = datetime.combine(day, time.min, tzinfo=zone)
+    day_end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=zone)
+    with manager_pool.lease() as calendar_manager:
+        events = calendar_manager.get_events(time_min=day_start, time_max=day_end, max_results=50)
+    slots = [event for event in events if event['title'] == 'Available']
+    return slot_leases.filter_available(slots, holder=holder)
+
+
+async def scan_availability(min_date: date, max_date: date) -> AsyncIterator[tuple[date, list]]:
+    """
+    Yield the open slots of each day between min_date and max_date as soon as
+    that day is scanned. The next day is fetched while the current one is
+    being consumed.
+    """
+    holder = current_thread_id.get()
+    days = [min_date + timedelta(days=i) for i in range(min((max_date - min_date).days + 1, SEARCH_MAX_DAYS))]
+    pending = None
+    try:
+        for i, day in enumerate(days):
+            # Calendar calls are blocking, keep them off the event loop
+            current = pending or asyncio.create_task(manager_pool.call(_day_slots, day, holder))
+            pending = asyncio.create_task(manager_pool.call(_day_slots, days[i + 1], holder)) if i + 1 < len(days) else None
+            yield day, await current
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+def _stream_writer():
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        # Not running inside the graph, e.g. from run()
+        return lambda chunk: None
+
+
+def _local_time(value: str, zone) -> str:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(zone)
+    return moment.strftime('%H:%M')
+
+
+def _format_day(day: date, slots: list, zone=timezone.utc) -> str:
+    if not slots:
+        return f"**{day.strftime('%A %b %d')}**: no open slots\n\n"
+    times = ", ".join(f"{_local_time(slot['start'], zone)}-{_local_time(slot['end'], zone)}" for slot in slots)
+    return f"**{day.strftime('%A %b %d')}**: {times}\n\n"
+
+
+@calendar_availability_agent.tool
+@with_tool_deadline
+async def search_available_slots_tool(ctx: RunContext[None], min_date: date, max_date: date) -> str:
+    """
+    List the open slots of every day between min_date and max_date (YYYY-MM-DD).
+    Each day is shown to the user as soon as it is found.
+    """
+    # Dates are validated by pydantic, a malformed one is sent back to the model to retry
+    writer = _stream_writer()
+    zone = business_zone()
+    found = []
+    async for day, slots in scan_availability(min_date, max_date):
+        writer(_format_day(day, slots, zone))
+        found.extend(slots)
+    return json.dumps(found, indent=2)
+
+
 async def run():
     """
     Main function to run the calendar availability agent.
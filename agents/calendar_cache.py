@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Callable, Hashable
+
+import dotenv
+
+from .shared_store import shared_store
+from .traffic import cache_ttl
+
+dotenv.load_dotenv()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+@dataclass
+class EventsCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    shared_hits: int = 0
+    invalidations: int = 0
+
+
+class EventsCache:
+    def __init__(self, ttl=30.0, max_entries=256, name="events", store=None):
+        """
+        Short-TTL cache for calendar reads with single-flight loading, so
+        identical concurrent queries share one API request.
+
+        Args:
+            ttl (float): Seconds a result stays fresh, 0 disables caching and coalescing
+            max_entries (int): Maximum number of cached queries
+            name (str): Name of the cache in the shared store
+            store (SharedStore): Store shared with other processes (optional)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.name = name
+        self.store = store
+        self._store_generations: dict[str, int] = {}
+        self._entries: OrderedDict[Hashable, tuple[float, list]] = OrderedDict()
+        self._inflight: dict[Hashable, _InFlight] = {}
+        self._generations: dict[str, int] = {}
+        self._calendar_ttls: dict[str, float] = {}
+        self._listeners: list[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+        self._stats = EventsCacheStats()
+
+    def get_or_load(self, calendar_id: str, key: Hashable, loader: Callable[[], list]) -> list:
+        """
+        Return the cached result for `key`, joining an identical in-flight
+        request or calling `loader` when there is neither.
+
+        Args:
+            calendar_id (str): Calendar the query targets, used for invalidation
+            key (Hashable): Normalized query (range, filters, ...)
+            loader (callable): Performs the actual API request
+
+        Returns:
+            list: List of calendar events
+        """
+        if self.ttl <= 0:
+            return loader()
+        if self.store is not None:
+            self.sync(calendar_id)
+        key = (calendar_id, key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return _copy(entry[1])
+
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlight()
+                self._inflight[key] = call
+                generation = self._generations.get(calendar_id, 0)
+                self._stats.misses += 1
+            else:
+                self._stats.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return _copy(call.result)
+
+        try:
+            call.result = self._load_shared(calendar_id, key, loader)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                # Results loaded across an invalidation could already be stale
+                if call.error is None and self._generations.get(calendar_id, 0) == generation:
+                    ttl = self._calendar_ttls.get(calendar_id, self.ttl)
+                    self._entries[key] = (time.monotonic() + ttl, call.result)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            call.done.set()
+
+        return _copy(call.result)
+
+    def _load_shared(self, calendar_id: str, key: tuple, loader: Callable[[], list]) -> list:
+        if self.store is None:
+            return loader()
+        store_key = repr(key)
+        result = self.store.get_entry(self.name, store_key)
+        if result is not None:
+            with self._lock:
+                self._stats.shared_hits += 1
+            return result
+        generation = self._store_generations.get(calendar_id, 0)
+        result = loader()
+        ttl = self._calendar_ttls.get(calendar_id, self.ttl)
+        self.store.put_entry(self.name, store_key, calendar_id, result, ttl, generation)
+        return result
+
+    def sync(self, calendar_id: str):
+        """
+        Apply invalidations made by other processes since the last check.
+        Only needed with a shared store.
+        """
+        if self.store is None:
+            return
+        generation = self.store.generation(calendar_id)
+        with self._lock:
+            seen = self._store_generations.get(calendar_id)
+            self._store_generations[calendar_id] = generation
+        if seen is not None and generation != seen:
+            self._invalidate_local(calendar_id)
+
+    def invalidate(self, calendar_id: str):
+        """Drop every cached query for a calendar, e.g. after a write"""
+        if self.store is not None:
+            generation = self.store.invalidate(calendar_id)
+            with self._lock:
+                self._store_generations[calendar_id] = generation
+        self._invalidate_local(calendar_id)
+
+    def _invalidate_local(self, calendar_id: str):
+        with self._lock:
+            self._generations[calendar_id] = self._generations.get(calendar_id, 0) + 1
+            for key in [k for k in self._entries if k[0] == calendar_id]:
+                del self._entries[key]
+            self._stats.invalidations += 1
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(calendar_id)
+
+    def set_calendar_ttl(self, calendar_id: str, ttl: float | None):
+        """
+        Override the TTL of a calendar, e.g. a longer one while push
+        notifications keep it fresh. `None` restores the default.
+        """
+        with self._lock:
+            if ttl is None:
+                self._calendar_ttls.pop(calendar_id, None)
+            else:
+                self._calendar_ttls[calendar_id] = ttl
+
+    def add_invalidation_listener(self, listener: Callable[[str], None]):
+        """Call `listener(calendar_id)` whenever a calendar is invalidated"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return asdict(self._stats)
+
+
+def _copy(events: list) -> list:
+    return [dict(event) for event in events]
+
+
+events_cache = EventsCache(
+    ttl=cache_ttl("CALENDAR_CACHE_TTL", "30"),
+    max_entries=int(os.getenv("CALENDAR_CACHE_MAX_ENTRIES", "256")),
+    store=shared_store,
+)
@@ -0,0 +1,221 @@
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import dotenv
+import logfire
+
+from .calendar_cache import events_cache
+from .tenants import manager_pool, tenant_registry
+
+dotenv.load_dotenv()
+
+
+@dataclass
+class WatchChannel:
+    id: str
+    resource_id: str
+    tenant_id: str
+    calendar_id: str
+    expiration: float
+
+
+class CalendarWatcher:
+    def __init__(self, address, token=None, ttl_seconds=7 * 24 * 3600, renew_margin=3600, cache_ttl=300.0):
+        """
+        Keep Google Calendar push notification channels alive and invalidate
+        the events cache as soon as a watched calendar changes.
+
+        Args:
+            address (str): Public HTTPS URL that reaches the webhook receiver
+            token (str): Shared secret checked on every notification
+            ttl_seconds (int): Requested channel lifetime
+            renew_margin (int): Seconds before expiry a channel is renewed
+            cache_ttl (float): Cache TTL for watched calendars
+        """
+        self.address = address
+        self.token = token or secrets.token_urlsafe(24)
+        self.ttl_seconds = ttl_seconds
+        self.renew_margin = renew_margin
+        self.cache_ttl = cache_ttl
+        self.channels: dict[str, WatchChannel] = {}
+        self._timers: dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, tenant_id: str) -> WatchChannel:
+        """Open a channel for a tenant's calendar and schedule its renewal"""
+        with manager_pool.lease(tenant_id) as calendar_manager:
+            result = calendar_manager.watch_events(
+                channel_id=str(uuid.uuid4()),
+                address=self.address,
+                token=self.token,
+                ttl_seconds=self.ttl_seconds
+            )
+            calendar_id = calendar_manager.calendar_id
+
+        channel = WatchChannel(
+            id=result['id'],
+            resource_id=result['resource_id'],
+            tenant_id=tenant_id,
+            calendar_id=calendar_id,
+            expiration=result['expiration'] / 1000 or time.time() + self.ttl_seconds,
+        )
+        with self._lock:
+            self.channels[channel.id] = channel
+        events_cache.set_calendar_ttl(calendar_id, self.cache_ttl)
+        events_cache.invalidate(calendar_id)
+        self._schedule_renewal(channel)
+        logfire.info("Watching calendar {calendar_id} on channel {channel_id}",
+                     calendar_id=calendar_id, channel_id=channel.id)
+        return channel
+
+    def _schedule_renewal(self, channel: WatchChannel):
+        delay = max(0.0, channel.expiration - self.renew_margin - time.time())
+        timer = threading.Timer(delay, self._renew, args=(channel.id,))
+        timer.daemon = True
+        with self._lock:
+            self._timers[channel.id] = timer
+        timer.start()
+
+    def _renew(self, channel_id: str):
+        with self._lock:
+            old = self.channels.get(channel_id)
+        if old is None:
+            return
+        try:
+            # Open the new channel before closing the old one so no change is missed
+            self.watch(old.tenant_id)
+        except Exception as e:
+            logfire.error("Failed to renew channel {channel_id}: {error}", channel_id=channel_id, error=str(e))
+            old.expiration = time.time() + self.renew_margin + 60
+            self._schedule_renewal(old)
+            return
+        self.stop(channel_id, reset_ttl=False)
+
+    def stop(self, channel_id: str, reset_ttl=True):
+        with self._lock:
+            channel = self.channels.pop(channel_id, None)
+            timer = self._timers.pop(channel_id, None)
+        if timer is not None:
+            timer.cancel()
+        if channel is None:
+            return
+        if reset_ttl:
+            events_cache.set_calendar_ttl(channel.calendar_id, None)
+        try:
+            with manager_pool.lease(channel.tenant_id) as calendar_manager:
+                calendar_manager.stop_channel(channel.id, channel.resource_id)
+        except Exception as e:
+            logfire.warn("Failed to stop channel {channel_id}: {error}", channel_id=channel_id, error=str(e))
+
+    def stop_all(self):
+        for channel_id in list(self.channels):
+            self.stop(channel_id)
+
+    def handle_notification(self, headers) -> bool:
+        """
+        Handle a notification posted by Google.
+
+        Args:
+            headers: Request headers (X-Goog-Channel-ID, X-Goog-Channel-Token, X-Goog-Resource-State)
+
+        Returns:
+            bool: False if the notification does not belong to a known channel
+        """
+        with self._lock:
+            channel = self.channels.get(headers.get('X-Goog-Channel-ID', ''))
+        if channel is None or headers.get('X-Goog-Channel-Token') != self.token:
+            return False
+
+        # "sync" only confirms that the channel was created
+        if headers.get('X-Goog-Resource-State') == 'sync':
+            return True
+
+        # The next read fetches the changes, no need to spend quota on a sync here
+        events_cache.invalidate(channel.calendar_id)
+        logfire.info("Calendar {calendar_id} changed", calendar_id=channel.calendar_id)
+        return True
+
+
+def make_webhook_handler(watcher: CalendarWatcher):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            # Notifications carry everything in the headers, the body is empty
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self.send_response(200 if watcher.handle_notification(self.headers) else 404)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+def serve_webhook(watcher: CalendarWatcher, host='0.0.0.0', port=8765) -> ThreadingHTTPServer:
+    """Run the webhook receiver in a background thread"""
+    server = ThreadingHTTPServer((host, port), make_webhook_handler(watcher))
+    threading.Thread(target=server.serve_forever, name="calendar-webhook", daemon=True).start()
+    return server
+
+
+def send_test_notification(url, channel_id, token, state='exists'):
+    """
+    Local stand-in for Google: post a notification like the ones sent for a
+    watched calendar.
+
+    Returns:
+        int: HTTP status returned by the receiver
+    """
+    request = urllib.request.Request(url, data=b'', method='POST', headers={
+        'X-Goog-Channel-ID': channel_id,
+        'X-Goog-Channel-Token': token,
+        'X-Goog-Resource-State': state,
+        'X-Goog-Resource-ID': 'local-test',
+        'X-Goog-Message-Number': '1',
+    })
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def start_from_env() -> CalendarWatcher | None:
+    """
+    Watch every tenant calendar when CALENDAR_WEBHOOK_ADDRESS is set.
+    """
+    address = os.getenv("CALENDAR_WEBHOOK_ADDRESS")
+    if not address:
+        return None
+
+    watcher = CalendarWatcher(
+        address=address,
+        token=os.getenv("CALENDAR_WEBHOOK_TOKEN"),
+        cache_ttl=float(os.getenv("CALENDAR_WATCHED_CACHE_TTL", "300")),
+    )
+    serve_webhook(watcher, port=int(os.getenv("CALENDAR_WEBHOOK_PORT", "8765")))
+    for tenant_id in tenant_registry.tenants:
+        try:
+            watcher.watch(tenant_id)
+        except Exception as e:
+            logfire.error("Failed to watch tenant {tenant_id}: {error}", tenant_id=tenant_id, error=str(e))
+    return watcher
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Post a test calendar notification to a local webhook receiver")
+    parser.add_argument("channel_id")
+    parser.add_argument("--url", default=f"http://localhost:{os.getenv('CALENDAR_WEBHOOK_PORT', '8765')}/")
+    parser.add_argument("--token", default=os.getenv("CALENDAR_WEBHOOK_TOKEN", ""))
+    parser.add_argument("--state", default="exists")
+    args = parser.parse_args()
+
+    print(send_test_notification(args.url, args.channel_id, args.token, args.state))
@@ -0,0 +1,35 @@
+import asyncio
+import functools
+import os
+
+import dotenv
+dotenv.load_dotenv()
+
+NODE_DEADLINE = float(os.getenv("NODE_DEADLINE", "60"))
+TOOL_DEADLINE = float(os.getenv("TOOL_DEADLINE", "20"))
+
+
+def node_deadline(node_name: str) -> float:
+    """Seconds a graph node may run, overridable with NODE_DEADLINE_<NODE_NAME>"""
+    return float(os.getenv(f"NODE_DEADLINE_{node_name.upper()}", NODE_DEADLINE))
+
+
+def tool_deadline(tool_name: str) -> float:
+    """Seconds an agent tool may run, overridable with TOOL_DEADLINE_<TOOL_NAME>"""
+    return float(os.getenv(f"TOOL_DEADLINE_{tool_name.upper()}", TOOL_DEADLINE))
+
+
+def with_tool_deadline(tool):
+    """
+    Bound the run time of an async agent tool. On timeout the model is told
+    the calendar did not answer instead of the whole run failing.
+    """
+    @functools.wraps(tool)
+    async def wrapper(*args, **kwargs):
+        deadline = tool_deadline(tool.__name__)
+        try:
+            async with asyncio.timeout(deadline):
+                return await tool(*args, **kwargs)
+        except TimeoutError:
+            return f"The calendar did not answer within {deadline:.0f} seconds. Ask the user to try again in a moment."
+    return wrapper
@@ -28,7 +28,7 @@ Output:
 - Return the required data
 """
 
-model = get_model()
+model = get_model("gather_contact_information")
 
 async def format_user_info(ctx: RunContext, info) -> MeetingDetails:
     return MeetingDetails(
@@ -45,7 +45,7 @@ gather_contact_information_agent = Agent(
     output_type=Union[str, MeetingDetails]
 )
 
-@dataclass
+@dataclass(slots=True)
 class ContactInformation:
     """Model to hold user contact information."""
     full_name: str
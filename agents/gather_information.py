@@ -10,7 +10,7 @@ from datetime import datetime
 
 
 
-model = get_model()
+model = get_model("gather_information")
 
 prompt = """
 Role: Calendar Availability Agent
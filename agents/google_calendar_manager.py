@@ -3,6 +3,10 @@ from dataclasses import dataclass
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+from .rate_limiter import rate_limiter
+from .calendar_cache import events_cache
+from . import recurrence, traffic
 import os
 import dotenv
 dotenv.load_dotenv()
@@ -20,19 +24,27 @@ class GoogleEvent:
     status: str = ""
 
 class GoogleCalendarManager:
-    def __init__(self, service_account_file, calendar_id=None):
+    def __init__(self, service_account_file, calendar_id=None, expand_recurring_locally=None):
         """
         Initialize Google Calendar API client with service account
         
         Args:
             service_account_file (str): Path to service account JSON file
             calendar_id (str): Calendar ID to work with (defaults to primary)
+            expand_recurring_locally (bool): Expand recurring events from cached series instead of
+                singleEvents=True (defaults to CALENDAR_EXPANSION=local)
         """
         self.calendar_id = calendar_id or 'primary'
+        if expand_recurring_locally is None:
+            expand_recurring_locally = os.getenv("CALENDAR_EXPANSION", "server") == "local"
+        self.expand_recurring_locally = expand_recurring_locally
         self.service = self._authenticate(service_account_file)
     
     def _authenticate(self, service_account_file):
         """Authenticate using service account credentials"""
+        if traffic.TRAFFIC_MODE == "replay":
+            # Recorded responses need neither credentials nor network access
+            return build('calendar', 'v3', http=traffic.ReplayHttp())
         try:
             # Scopes required for calendar access
             SCOPES = ['https://www.googleapis.com/auth/calendar']
@@ -43,12 +55,19 @@ class GoogleCalendarManager:
             )
             
             # Build the service
+            if traffic.TRAFFIC_MODE == "record":
+                http = AuthorizedHttp(credentials, http=traffic.RecordingHttp())
+                return build('calendar', 'v3', http=http)
             service = build('calendar', 'v3', credentials=credentials)
             return service
             
         except Exception as e:
             raise Exception(f"Authentication failed: {str(e)}")
 
+    def _execute(self, request):
+        """Execute an API request through the shared rate limiter"""
+        return rate_limiter.execute(self.calendar_id, request)
+
     def get_events(self, time_min=None, time_max=None, max_results=10) -> list[GoogleEvent]:
         """
         Get events from calendar
@@ -77,25 +96,66 @@ class GoogleCalendarManager:
                 time_max_str = time_max.isoformat()
             else:
                 time_max_str = None
+
+            if self.expand_recurring_locally:
+                return recurrence.get_expanded_events(self, time_min, time_max, max_results)
             
-            # Build the request
-            events_request = self.service.events().list(
-                calendarId=self.calendar_id,
-                timeMin=time_min_str,
-                timeMax=time_max_str,
-                maxResults=max_results,
-                singleEvents=True,
-                orderBy='startTime'
+            def load():
+                # Build the request
+                events_request = self.service.events().list(
+                    calendarId=self.calendar_id,
+                    timeMin=time_min_str,
+                    timeMax=time_max_str,
+                    maxResults=max_results,
+                    singleEvents=True,
+                    orderBy='startTime'
+                )
+
+                events_result = self._execute(events_request)
+                events = events_result.get('items', [])
+
+                return self._format_events(events)
+
+            # Identical concurrent queries share one request and a short-lived result
+            return events_cache.get_or_load(
+                self.calendar_id,
+                (time_min_str, time_max_str, max_results),
+                load
             )
-            
-            events_result = events_request.execute()
-            events = events_result.get('items', [])
-            
-            return self._format_events(events)
                     
         except HttpError as error:
                     raise Exception(f"Failed to get events: {error}")
     
+    def get_event_series(self, time_min):
+        """
+        Get recurring masters, their exceptions and one-off events without expanding them
+        
+        Args:
+            time_min (datetime): Only series and events ending after this time
+            
+        Returns:
+            list: Raw calendar events
+        """
+        try:
+            items = []
+            page_token = None
+            while True:
+                events_result = self._execute(self.service.events().list(
+                    calendarId=self.calendar_id,
+                    timeMin=time_min.isoformat(),
+                    pageToken=page_token,
+                    maxResults=2500,
+                    showDeleted=True,
+                    singleEvents=False
+                ))
+                items.extend(events_result.get('items', []))
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    return items
+
+        except HttpError as error:
+            raise Exception(f"Failed to get event series: {error}")
+    
     def create_event(self, title, start_time, end_time, description=None, location=None):
         """
         Create a new calendar event
@@ -128,10 +188,11 @@ class GoogleCalendarManager:
             if location:
                 event_body['location'] = location
             
-            event = self.service.events().insert(
+            event = self._execute(self.service.events().insert(
                 calendarId=self.calendar_id,
                 body=event_body
-            ).execute()
+            ))
+            events_cache.invalidate(self.calendar_id)
             
             return {
                 'id': event['id'],
@@ -145,7 +206,7 @@ class GoogleCalendarManager:
             raise Exception(f"Failed to create event: {error}")
     
     def update_event(self, event_id, title=None, start_time=None, end_time=None, 
-                    description=None, location=None, attendees_to_add=None):
+                    description=None, location=None, attendees_to_add=None, booking_key=None):
         """
         Update an existing calendar event
         
@@ -157,68 +218,171 @@ class GoogleCalendarManager:
             description (str): New description (optional)
             location (str): New location (optional)
             attendees_to_add (list): List of attendee emails to add (optional)
+            booking_key (str): Idempotency key stored on the event; an update already
+                applied with the same key is skipped, one from another key fails (optional)
             
         Returns:
             dict: Updated event details
         """
         try:
-            # Get existing event first
-            event = self.service.events().get(
-                calendarId=self.calendar_id,
-                eventId=event_id
-            ).execute()
-            
-            # Update fields if provided
-            if title:
-                event['summary'] = title
-            if start_time:
-                event['start'] = {
-                    'dateTime': start_time.isoformat(),
-                    'timeZone': 'UTC',
-                }
-            if end_time:
-                event['end'] = {
-                    'dateTime': end_time.isoformat(),
-                    'timeZone': 'UTC',
-                }
-            if description is not None:
-                event['description'] = description
-            if location is not None:
-                event['location'] = location
+            # With a booking key the update only applies to the version of the event
+            # that was read (If-Match on its etag), so two concurrent bookings of the
+            # same slot can't both succeed; a conflict re-reads the event and checks again
+            for attempt in range(3):
+                event = self._execute(self.service.events().get(
+                    calendarId=self.calendar_id,
+                    eventId=event_id
+                ))
+
+                if booking_key:
+                    private = event.setdefault('extendedProperties', {}).setdefault('private', {})
+                    existing_key = private.get('bookingKey')
+                    if existing_key == booking_key:
+                        # Already applied by a previous attempt
+                        return self._format_updated_event(event)
+                    if existing_key:
+                        raise Exception(f"Failed to update event: {event_id} is already booked")
+                    private['bookingKey'] = booking_key
+
+                # Update fields if provided
+                if title:
+                    event['summary'] = title
+                if start_time:
+                    event['start'] = {
+                        'dateTime': start_time.isoformat(),
+                        'timeZone': 'UTC',
+                    }
+                if end_time:
+                    event['end'] = {
+                        'dateTime': end_time.isoformat(),
+                        'timeZone': 'UTC',
+                    }
+                if description is not None:
+                    event['description'] = description
+                if location is not None:
+                    event['location'] = location
             
-            # Add attendees if provided
-            if attendees_to_add:
-                # Initialize attendees list if it doesn't exist
-                if 'attendees' not in event:
-                    event['attendees'] = []
+                # Add attendees if provided
+                if attendees_to_add:
+                    # Initialize attendees list if it doesn't exist
+                    if 'attendees' not in event:
+                        event['attendees'] = []
                     
-                # Add new attendees
-                for attendee in attendees_to_add:
-                    if isinstance(attendee, str):
-                        # If just an email is provided
-                        event['attendees'].append({'email': attendee})
-                    elif isinstance(attendee, dict) and 'email' in attendee:
-                        # If attendee is provided as a dictionary
-                        event['attendees'].append(attendee)
+                    # Add new attendees
+                    for attendee in attendees_to_add:
+                        if isinstance(attendee, str):
+                            # If just an email is provided
+                            event['attendees'].append({'email': attendee})
+                        elif isinstance(attendee, dict) and 'email' in attendee:
+                            # If attendee is provided as a dictionary
+                            event['attendees'].append(attendee)
             
-            # Update the event
-            updated_event = self.service.events().update(
-                calendarId=self.calendar_id,
-                eventId=event_id,
-                body=event
-            ).execute()
+                # Update the event
+                request = self.service.events().update(
+                    calendarId=self.calendar_id,
+                    eventId=event_id,
+                    body=event
+                )
+                if booking_key and event.get('etag'):
+                    request.headers['If-Match'] = event['etag']
+                try:
+                    updated_event = self._execute(request)
+                except HttpError as error:
+                    if booking_key and error.resp is not None and error.resp.status == 412 and attempt < 2:
+                        # Changed since it was read, e.g. booked by another worker
+                        continue
+                    raise
+                events_cache.invalidate(self.calendar_id)
+
+                return self._format_updated_event(updated_event)
+
+        except HttpError as error:
+            raise Exception(f"Failed to update event: {error}")
+    
+    def watch_events(self, channel_id, address, token=None, ttl_seconds=None):
+        """
+        Register a push notification channel for changes to the calendar's events
+        
+        Args:
+            channel_id (str): Unique ID of the new channel
+            address (str): HTTPS URL Google will post notifications to
+            token (str): Secret echoed back in every notification (optional)
+            ttl_seconds (int): Requested channel lifetime (optional)
             
+        Returns:
+            dict: Channel ID, resource ID and expiration (milliseconds since epoch)
+        """
+        try:
+            body = {'id': channel_id, 'type': 'web_hook', 'address': address}
+            if token:
+                body['token'] = token
+            if ttl_seconds:
+                body['params'] = {'ttl': str(int(ttl_seconds))}
+
+            channel = self._execute(self.service.events().watch(
+                calendarId=self.calendar_id,
+                body=body
+            ))
             return {
-                'id': updated_event['id'],
-                'title': updated_event['summary'],
-                'start': updated_event['start'].get('dateTime', updated_event['start'].get('date')),
-                'end': updated_event['end'].get('dateTime', updated_event['end'].get('date')),
-                'link': updated_event.get('htmlLink'),
-                'attendees': updated_event.get('attendees', [])
+                'id': channel['id'],
+                'resource_id': channel['resourceId'],
+                'expiration': int(channel.get('expiration', 0)),
             }
+
+        except HttpError as error:
+            raise Exception(f"Failed to watch events: {error}")
+
+    def stop_channel(self, channel_id, resource_id):
+        """
+        Stop a push notification channel
+        
+        Args:
+            channel_id (str): ID of the channel
+            resource_id (str): Resource ID returned when the channel was created
             
+        Returns:
+            bool: True if successful
+        """
+        try:
+            self._execute(self.service.channels().stop(
+                body={'id': channel_id, 'resourceId': resource_id}
+            ))
+            return True
+
         except HttpError as error:
-            raise Exception(f"Failed to update event: {error}")
+            raise Exception(f"Failed to stop channel: {error}")
+
+    def sync_events(self, sync_token=None):
+        """
+        Incrementally sync events, starting with a full sync when no token is given
+        
+        Args:
+            sync_token (str): Token returned by the previous sync (optional)
+            
+        Returns:
+            tuple: Changed events (including cancelled ones) and the next sync token
+        """
+        try:
+            items = []
+            page_token = None
+            while True:
+                events_result = self._execute(self.service.events().list(
+                    calendarId=self.calendar_id,
+                    syncToken=sync_token,
+                    pageToken=page_token,
+                    showDeleted=True,
+                    singleEvents=True
+                ))
+                items.extend(events_result.get('items', []))
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    return self._format_events(items), events_result.get('nextSyncToken')
+
+        except HttpError as error:
+            # 410 Gone: the sync token expired and a full sync is required
+            if sync_token and error.resp.status == 410:
+                return self.sync_events()
+            raise Exception(f"Failed to sync events: {error}")
     
     def delete_event(self, event_id):
         """
@@ -231,15 +395,26 @@ class GoogleCalendarManager:
             bool: True if successful
         """
         try:
-            self.service.events().delete(
+            self._execute(self.service.events().delete(
                 calendarId=self.calendar_id,
                 eventId=event_id
-            ).execute()
+            ))
+            events_cache.invalidate(self.calendar_id)
             return True
             
         except HttpError as error:
             raise Exception(f"Failed to delete event: {error}")
     
+    def _format_updated_event(self, event):
+        return {
+            'id': event['id'],
+            'title': event['summary'],
+            'start': event['start'].get('dateTime', event['start'].get('date')),
+            'end': event['end'].get('dateTime', event['end'].get('date')),
+            'link': event.get('htmlLink'),
+            'attendees': event.get('attendees', [])
+        }
+
     def _format_events(self, events):
         """Format events for easier consumption"""
         formatted_events = []
@@ -248,8 +423,9 @@ class GoogleCalendarManager:
             formatted_event = {
                 'id': event['id'],
                 'title': event.get('summary', 'No Title'),
-                'start': event['start'].get('dateTime', event['start'].get('date')),
-                'end': event['end'].get('dateTime', event['end'].get('date')),
+                # Cancelled events returned by an incremental sync have no times
+                'start': event.get('start', {}).get('dateTime', event.get('start', {}).get('date')),
+                'end': event.get('end', {}).get('dateTime', event.get('end', {}).get('date')),
                 'description': event.get('description', ''),
                 'location': event.get('location', ''),
                 'link': event.get('htmlLink', ''),
@@ -3,7 +3,18 @@ from pydantic_ai.models.anthropic import AnthropicModel
 from dotenv import load_dotenv
 import os
 
+from . import traffic
+
 load_dotenv()
 
-def get_model():
-    return AnthropicModel('claude-3-7-sonnet-latest')
+def get_model(agent: str = "default"):
+    """
+    Model used by an agent. With TRAFFIC_MODE=record its responses are recorded
+    per thread, with TRAFFIC_MODE=replay they are served from the recordings.
+    """
+    if traffic.TRAFFIC_MODE == "replay":
+        return traffic.replay_model(agent)
+    model = AnthropicModel('claude-3-7-sonnet-latest')
+    if traffic.TRAFFIC_MODE == "record":
+        return traffic.RecordingModel(model, agent)
+    return model
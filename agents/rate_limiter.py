@@ -0,0 +1,183 @@
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, asdict
+
+from googleapiclient.errors import HttpError
+import dotenv
+dotenv.load_dotenv()
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """
+        Thread-safe token bucket
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Maximum number of tokens (burst size)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take one token, going into debt if the bucket is empty.
+
+        Returns:
+            float: Seconds the caller has to wait before using the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+@dataclass
+class RateLimiterStats:
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class CalendarRateLimiter:
+    def __init__(self, global_qps=10.0, global_burst=10, calendar_qps=5.0, calendar_burst=5,
+                 max_retries=5, base_delay=0.5, max_delay=32.0):
+        """
+        Process-wide rate limiter for the Google Calendar API, with one global
+        bucket shared by every calendar plus one bucket per calendar.
+
+        Args:
+            global_qps (float): Requests per second allowed across all calendars
+            global_burst (int): Burst size of the global bucket
+            calendar_qps (float): Requests per second allowed per calendar
+            calendar_burst (int): Burst size of each calendar bucket
+            max_retries (int): Retries for rate-limit and transient server errors
+            base_delay (float): First backoff delay in seconds
+            max_delay (float): Upper bound for a single backoff delay in seconds
+        """
+        self.global_bucket = TokenBucket(global_qps, global_burst)
+        self.calendar_qps = calendar_qps
+        self.calendar_burst = calendar_burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._calendar_buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._stats = RateLimiterStats()
+
+    def configure(self, global_qps: float | None = None, calendar_qps: float | None = None):
+        """
+        Change the request budget, e.g. to give a batch import its share of the quota.
+
+        Args:
+            global_qps (float): Requests per second allowed across all calendars
+            calendar_qps (float): Requests per second allowed per calendar
+        """
+        with self._lock:
+            if global_qps is not None:
+                self.global_bucket = TokenBucket(global_qps, max(1, int(global_qps)))
+            if calendar_qps is not None:
+                self.calendar_qps = calendar_qps
+                self.calendar_burst = max(1, int(calendar_qps))
+                self._calendar_buckets.clear()
+
+    def _calendar_bucket(self, calendar_id: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._calendar_buckets.get(calendar_id)
+            if bucket is None:
+                bucket = TokenBucket(self.calendar_qps, self.calendar_burst)
+                self._calendar_buckets[calendar_id] = bucket
+            return bucket
+
+    def acquire(self, calendar_id: str) -> float:
+        """Block until both the global and the calendar bucket allow a request"""
+        wait = max(self.global_bucket.reserve(), self._calendar_bucket(calendar_id).reserve())
+        if wait > 0:
+            time.sleep(wait)
+        with self._lock:
+            self._stats.requests += 1
+            self._stats.total_wait += wait
+            self._stats.max_wait = max(self._stats.max_wait, wait)
+        return wait
+
+    def execute(self, calendar_id: str, request):
+        """
+        Execute a googleapiclient request under the rate limit, retrying
+        quota and transient errors with jittered exponential backoff.
+
+        Args:
+            calendar_id (str): Calendar the request targets
+            request: googleapiclient HttpRequest
+
+        Returns:
+            dict: The response of the request
+        """
+        attempt = 0
+        while True:
+            self.acquire(calendar_id)
+            try:
+                return request.execute()
+            except HttpError as error:
+                if attempt >= self.max_retries or not is_retryable(error):
+                    with self._lock:
+                        self._stats.failures += 1
+                    raise
+                delay = self._backoff(attempt, error)
+                attempt += 1
+                with self._lock:
+                    self._stats.retries += 1
+                time.sleep(delay)
+
+    def _backoff(self, attempt: int, error: HttpError) -> float:
+        retry_after = error.resp.get("retry-after") if error.resp is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_delay)
+        # Full jitter keeps concurrent sessions from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def stats(self) -> dict:
+        """Snapshot of queue wait and retry counters"""
+        with self._lock:
+            return asdict(self._stats)
+
+
+def is_retryable(error: HttpError) -> bool:
+    """Whether an HttpError is a quota or transient error worth retrying"""
+    status = error.resp.status if error.resp is not None else None
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403:
+        return _error_reason(error) in RETRYABLE_REASONS
+    return False
+
+
+def _error_reason(error: HttpError) -> str:
+    try:
+        content = json.loads(error.content)
+        return content["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ""
+
+
+rate_limiter = CalendarRateLimiter(
+    global_qps=float(os.getenv("CALENDAR_GLOBAL_QPS", "10")),
+    global_burst=int(os.getenv("CALENDAR_GLOBAL_BURST", "10")),
+    calendar_qps=float(os.getenv("CALENDAR_PER_CALENDAR_QPS", "5")),
+    calendar_burst=int(os.getenv("CALENDAR_PER_CALENDAR_BURST", "5")),
+    max_retries=int(os.getenv("CALENDAR_MAX_RETRIES", "5")),
+)
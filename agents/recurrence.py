@@ -0,0 +1,147 @@
+import os
+from datetime import datetime, date, timedelta, timezone
+
+from dateutil import parser as date_parser, tz
+from dateutil.rrule import rrulestr
+import dotenv
+import logfire
+
+from .calendar_cache import EventsCache, events_cache
+from .traffic import cache_ttl
+
+dotenv.load_dotenv()
+
+# Masters change rarely, and every write or push notification invalidates them
+series_cache = EventsCache(
+    ttl=cache_ttl("RECURRENCE_CACHE_TTL", "3600"),
+    max_entries=64,
+)
+events_cache.add_invalidation_listener(series_cache.invalidate)
+
+DEFAULT_HORIZON = timedelta(days=int(os.getenv("RECURRENCE_HORIZON_DAYS", "90")))
+
+
+def _event_start(value: dict) -> datetime:
+    if 'dateTime' in value:
+        return date_parser.isoparse(value['dateTime'])
+    return datetime.combine(date.fromisoformat(value['date']), datetime.min.time(), tzinfo=timezone.utc)
+
+
+def _overlaps(event: dict, time_min: datetime, time_max: datetime) -> bool:
+    return _event_start(event['start']) < time_max and _event_start(event['end']) > time_min
+
+
+def _instance_id(master: dict, start: datetime) -> str:
+    # Same IDs as the ones Google gives expanded instances, so bookings can target them
+    if 'date' in master['start']:
+        return f"{master['id']}_{start.strftime('%Y%m%d')}"
+    return f"{master['id']}_{start.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+
+
+def _as_value(master_value: dict, moment: datetime) -> dict:
+    if 'date' in master_value:
+        return {'date': moment.date().isoformat()}
+    return {'dateTime': moment.isoformat(), 'timeZone': master_value.get('timeZone', 'UTC')}
+
+
+def _expand_series(item: dict, time_min: datetime, time_max: datetime) -> list[dict]:
+    """Instances of one recurring master that overlap a window"""
+    start = _event_start(item['start'])
+    duration = _event_start(item['end']) - start
+    all_day = 'date' in item['start']
+
+    if all_day:
+        # Date-only UNTIL values are floating, so all-day series are expanded in naive time
+        start = start.replace(tzinfo=None)
+    elif item['start'].get('timeZone'):
+        # Repeat in wall-clock time of the series so DST changes are respected
+        start = start.astimezone(tz.gettz(item['start']['timeZone']))
+    rules = rrulestr("\n".join(item['recurrence']), dtstart=start, forceset=True)
+    window_min, window_max = time_min - duration, time_max
+    if all_day:
+        window_min = window_min.astimezone(timezone.utc).replace(tzinfo=None)
+        window_max = window_max.astimezone(timezone.utc).replace(tzinfo=None)
+
+    instances = []
+    for occurrence in rules.between(window_min, window_max, inc=True):
+        if all_day:
+            occurrence = occurrence.replace(tzinfo=timezone.utc)
+        if occurrence + duration <= time_min:
+            continue
+        instance = {k: v for k, v in item.items() if k != 'recurrence'}
+        instance.update(
+            id=_instance_id(item, occurrence),
+            start=_as_value(item['start'], occurrence),
+            end=_as_value(item['end'], occurrence + duration),
+            recurringEventId=item['id'],
+        )
+        instances.append(instance)
+    return instances
+
+
+def expand_events(items: list[dict], time_min: datetime, time_max: datetime) -> list[dict]:
+    """
+    Expand recurring masters into the instances that overlap a window,
+    applying moved and cancelled exceptions. A series whose rules can't be
+    expanded is skipped rather than failing the whole query.
+
+    Args:
+        items (list): Raw events fetched with singleEvents=False
+        time_min (datetime): Start of the window
+        time_max (datetime): End of the window
+
+    Returns:
+        list: Raw events, one per instance, sorted by start time
+    """
+    exceptions = {}
+    for item in items:
+        if 'recurringEventId' in item:
+            original = _event_start(item['originalStartTime'])
+            exceptions[(item['recurringEventId'], original)] = item
+
+    events = []
+    for item in items:
+        if item.get('status') == 'cancelled' or 'recurringEventId' in item:
+            continue
+
+        if 'recurrence' not in item:
+            if _overlaps(item, time_min, time_max):
+                events.append(item)
+            continue
+
+        try:
+            events.extend(_expand_series(item, time_min, time_max))
+        except Exception as e:
+            logfire.error("Could not expand recurring event {event_id}: {error}", event_id=item.get('id'), error=str(e))
+
+    # Moved or edited instances replace the generated ones
+    expanded = []
+    for event in events:
+        exception = exceptions.pop((event.get('recurringEventId'), _event_start(event['start'])), None)
+        if exception is None:
+            expanded.append(event)
+        elif exception.get('status') != 'cancelled' and _overlaps(exception, time_min, time_max):
+            expanded.append(exception)
+    # Instances moved into the window from outside of it
+    for exception in exceptions.values():
+        if exception.get('status') != 'cancelled' and _overlaps(exception, time_min, time_max):
+            expanded.append(exception)
+
+    expanded.sort(key=lambda event: _event_start(event['start']))
+    return expanded
+
+
+def get_expanded_events(calendar_manager, time_min: datetime, time_max: datetime | None, max_results: int) -> list[dict]:
+    """
+    Serve a get_events query from the cached series of the calendar.
+    """
+    # Series are cached per process; pick up writes made by other processes
+    events_cache.sync(calendar_manager.calendar_id)
+    series_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    items = series_cache.get_or_load(
+        calendar_manager.calendar_id,
+        ('series', series_start.isoformat()),
+        lambda: calendar_manager.get_event_series(series_start)
+    )
+    time_max = time_max or time_min + DEFAULT_HORIZON
+    return calendar_manager._format_events(expand_events(items, time_min, time_max)[:max_results])
@@ -0,0 +1,116 @@
+import copy
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from datetime import date
+from typing import Any
+
+import dotenv
+from pydantic_ai.messages import ModelMessage, ToolCallPart
+
+from .traffic import cache_ttl
+
+dotenv.load_dotenv()
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+
+def normalize_input(text: str) -> str:
+    """Lowercase, unify quotes and whitespace and drop trailing punctuation"""
+    text = unicodedata.normalize("NFKC", text).lower().replace("’", "'")
+    return re.sub(r"\s+", " ", text).strip().rstrip(".!?")
+
+
+def history_digest(messages: list[ModelMessage]) -> str:
+    """
+    Digest of what a conversation said so far, ignoring timestamps and tool
+    call IDs, so identical conversations map to the same digest.
+    """
+    digest = hashlib.sha256()
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, ToolCallPart):
+                text = part.tool_name + part.args_as_json_str()
+            else:
+                text = str(getattr(part, "content", ""))
+            digest.update(part.part_kind.encode())
+            digest.update(text.encode())
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, ttl=600.0, max_entries=2048):
+        """
+        LRU cache with a TTL for the structured outputs of the extraction
+        agents, so near-identical inputs in the same context skip the model call.
+
+        Args:
+            ttl (float): Seconds an output is reused, 0 disables the cache
+            max_entries (int): Maximum number of cached outputs
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = ResponseCacheStats()
+
+    @staticmethod
+    def key(agent: str, user_input: str, message_history: list[ModelMessage], deps=None) -> tuple:
+        """
+        Cache key of an agent run: the agent, the normalized input, today's
+        date (relative dates depend on it), the history digest and the deps.
+        """
+        return (agent, normalize_input(user_input), date.today().isoformat(), history_digest(message_history), repr(deps))
+
+    def get(self, key: tuple):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self._stats.expirations += 1
+                entry = None
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+        # Outputs are mutable models, every run gets its own copy
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: tuple, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = asdict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+response_cache = ResponseCache(
+    ttl=cache_ttl("RESPONSE_CACHE_TTL", "600"),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048")),
+)
@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Set by the graph nodes so tools can tell which conversation and tenant they run for
+current_thread_id: ContextVar[str | None] = ContextVar("current_thread_id", default=None)
+current_tenant_id: ContextVar[str | None] = ContextVar("current_tenant_id", default=None)
+
+
+@contextmanager
+def bind_run_context(config):
+    """
+    Expose the thread and tenant of a LangGraph run config to the tools
+    called while the context is active.
+    """
+    configurable = (config or {}).get("configurable", {})
+    thread_token = current_thread_id.set(configurable.get("thread_id"))
+    tenant_token = current_tenant_id.set(configurable.get("tenant_id"))
+    try:
+        yield
+    finally:
+        current_tenant_id.reset(tenant_token)
+        current_thread_id.reset(thread_token)
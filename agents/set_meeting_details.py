@@ -1,14 +1,15 @@
-import os
 from typing import Union
 from pydantic_ai import Agent, RunContext
 from dataclasses import dataclass
 from .model import get_model
-from .google_calendar_manager import GoogleCalendarManager
+from .tenants import tenant_registry
+from .booking_outbox import booking_outbox, DONE, FAILED
+from .run_context import current_thread_id
 from .calendar_availability import SelectedAppointment
 
-model = get_model()
+model = get_model("set_meeting_details")
 
-@dataclass
+@dataclass(slots=True)
 class MeetingDetails:
     full_name: str
     email: str
@@ -31,37 +32,42 @@ set_meeting_details_agent = Agent[MeetingDetails, str](
 @set_meeting_details_agent.tool
 def set_event(ctx: RunContext[MeetingDetails]) -> str:
     """
-    Create/update the calendar event for the selected appointment with the provided contact info.
-    Returns a short confirmation message with a link when available, or an error message if something fails.
+    Book the selected appointment with the provided contact info. The booking is
+    committed to the outbox and applied to the calendar in the background.
+    Returns a short acknowledgement, or an error message if something fails.
     """
     # Get meeting details from context
     meeting_details = ctx.deps
     if not isinstance(meeting_details, MeetingDetails) or not meeting_details.full_name or not meeting_details.email:
         return "Error: Missing required meeting information"
     
-    # Initialize calendar manager
-    calendar_manager = GoogleCalendarManager(
-        service_account_file='./client_secrets.json',
-        calendar_id=os.getenv("CALENDAR_ID", "primary")
-    )
-    
     # Create event description with contact info
     description = f"Meeting with {meeting_details.full_name}\nEmail: {meeting_details.email}"
     if meeting_details.phone_number:
         description += f"\nPhone: {meeting_details.phone_number}"
-    
-    # Create calendar event (simplified - would need proper datetime parsing in real usage)
+
+    event_id = meeting_details.selected_appointment.id
+    thread_id = current_thread_id.get()
+    # The same conversation booking the same slot again maps to the same booking
+    idempotency_key = f"{thread_id or meeting_details.email}:{event_id}"
+
     try:
-        event = calendar_manager.update_event(
-            event_id=meeting_details.selected_appointment.id,
-            title=f"Meeting with {meeting_details.full_name}",
-            description=description,
-            location="Online"
+        booking = booking_outbox.enqueue(
+            idempotency_key=idempotency_key,
+            tenant_id=tenant_registry.resolve().id,
+            event_id=event_id,
+            payload={
+                "title": f"Meeting with {meeting_details.full_name}",
+                "description": description,
+                "location": "Online",
+            },
+            thread_id=thread_id,
         )
-        print(event)
-        link = event.get("link") or event.get("htmlLink") or ""
-        if link:
-            return f"Event created successfully: {link}"
-        return "Event created successfully."
     except Exception as e:
         return f"Failed to create event: {str(e)}"
+
+    if booking["status"] == DONE:
+        return "Event created successfully."
+    if booking["status"] == FAILED:
+        return f"Failed to create event: {booking['error']}"
+    return "Booking received. The confirmation will be sent as soon as the calendar is updated."
@@ -0,0 +1,110 @@
+import json
+import os
+import time
+
+import dotenv
+
+from .sqlite_db import SqliteDatabase
+
+dotenv.load_dotenv()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    cache TEXT NOT NULL,
+    key TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (cache, key)
+);
+CREATE INDEX IF NOT EXISTS cache_entries_calendar ON cache_entries (calendar_id);
+CREATE TABLE IF NOT EXISTS calendar_generations (
+    calendar_id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slot_leases (
+    slot_id TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedStore:
+    def __init__(self, path='./shared_state.sqlite3'):
+        """
+        SQLite file shared by the worker processes of one machine: cached
+        Calendar reads, per-calendar invalidation generations and slot leases.
+
+        Args:
+            path (str): SQLite database file
+        """
+        self.path = path
+        self._db = SqliteDatabase(path, _SCHEMA)
+
+    def get_entry(self, cache: str, key: str):
+        row = self._db.conn.execute(
+            "SELECT value FROM cache_entries WHERE cache = ? AND key = ? AND expires_at > ?",
+            (cache, key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_entry(self, cache: str, key: str, calendar_id: str, value, ttl: float, generation: int):
+        """Store a loaded value, unless the calendar was invalidated since `generation` was read"""
+        self._db.conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (cache, key, calendar_id, expires_at, value)"
+            " SELECT ?, ?, ?, ?, ? WHERE COALESCE("
+            "(SELECT generation FROM calendar_generations WHERE calendar_id = ?), 0) = ?",
+            (cache, key, calendar_id, time.time() + ttl, json.dumps(value), calendar_id, generation),
+        )
+
+    def generation(self, calendar_id: str) -> int:
+        row = self._db.conn.execute(
+            "SELECT generation FROM calendar_generations WHERE calendar_id = ?", (calendar_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def invalidate(self, calendar_id: str) -> int:
+        """Drop the cached reads of a calendar in every process and return its new generation"""
+        with self._db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO calendar_generations (calendar_id, generation) VALUES (?, 1)"
+                " ON CONFLICT (calendar_id) DO UPDATE SET generation = generation + 1",
+                (calendar_id,),
+            )
+            conn.execute("DELETE FROM cache_entries WHERE calendar_id = ?", (calendar_id,))
+            return conn.execute(
+                "SELECT generation FROM calendar_generations WHERE calendar_id = ?", (calendar_id,)
+            ).fetchone()[0]
+
+    def hold_slot(self, slot_id: str, holder: str, ttl: float) -> bool:
+        """Same contract as SlotLeaseManager.hold, across processes"""
+        now = time.time()
+        with self._db.transaction() as conn:
+            conn.execute("DELETE FROM slot_leases WHERE expires_at <= ?", (now,))
+            row = conn.execute("SELECT holder FROM slot_leases WHERE slot_id = ?", (slot_id,)).fetchone()
+            if row is not None and row[0] != holder:
+                return False
+            conn.execute("DELETE FROM slot_leases WHERE holder = ? AND slot_id != ?", (holder, slot_id))
+            conn.execute(
+                "INSERT OR REPLACE INTO slot_leases (slot_id, holder, expires_at) VALUES (?, ?, ?)",
+                (slot_id, holder, now + ttl),
+            )
+        return True
+
+    def release_slot(self, slot_id: str, holder: str | None = None):
+        if holder is None:
+            self._db.conn.execute("DELETE FROM slot_leases WHERE slot_id = ?", (slot_id,))
+        else:
+            self._db.conn.execute("DELETE FROM slot_leases WHERE slot_id = ? AND holder = ?", (slot_id, holder))
+
+    def held_slots(self) -> dict[str, str]:
+        """Slot ID -> holder of the leases that have not expired"""
+        rows = self._db.conn.execute(
+            "SELECT slot_id, holder FROM slot_leases WHERE expires_at > ?", (time.time(),)
+        ).fetchall()
+        return dict(rows)
+
+
+# Only used when SHARED_STATE_PATH is set, i.e. when several worker processes run
+shared_store = SharedStore(os.environ["SHARED_STATE_PATH"]) if os.getenv("SHARED_STATE_PATH") else None
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import dotenv
+
+from .shared_store import shared_store
+
+dotenv.load_dotenv()
+
+
+class SlotLeaseManager:
+    def __init__(self, ttl=600.0, store=None):
+        """
+        Leases on "Available" events, so a slot selected in one
+        conversation is not offered to other conversations while the user
+        fills in their contact details.
+
+        Args:
+            ttl (float): Seconds a slot stays held without being booked
+            store (SharedStore): Keep the leases in a store shared with other processes (optional)
+        """
+        self.ttl = ttl
+        self.store = store
+        self._leases: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        for slot_id in [s for s, (_, expires_at) in self._leases.items() if expires_at <= now]:
+            del self._leases[slot_id]
+
+    def hold(self, slot_id: str, holder: str) -> bool:
+        """
+        Hold a slot for a conversation, replacing any other slot it held.
+
+        Args:
+            slot_id (str): ID of the "Available" event
+            holder (str): Conversation thread ID
+
+        Returns:
+            bool: False if another conversation already holds the slot
+        """
+        if self.store is not None:
+            return self.store.hold_slot(slot_id, holder, self.ttl)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            lease = self._leases.get(slot_id)
+            if lease is not None and lease[0] != holder:
+                return False
+            for held in [s for s, (h, _) in self._leases.items() if h == holder and s != slot_id]:
+                del self._leases[held]
+            self._leases[slot_id] = (holder, now + self.ttl)
+            return True
+
+    def release(self, slot_id: str, holder: str | None = None):
+        """Release a slot, only if `holder` holds it when given"""
+        if self.store is not None:
+            self.store.release_slot(slot_id, holder)
+            return
+        with self._lock:
+            lease = self._leases.get(slot_id)
+            if lease is not None and (holder is None or lease[0] == holder):
+                del self._leases[slot_id]
+
+    def filter_available(self, events: list, holder: str | None) -> list:
+        """Drop the events held by other conversations"""
+        if self.store is not None:
+            held = self.store.held_slots()
+            return [event for event in events if held.get(event['id'], holder) == holder]
+        with self._lock:
+            self._expire(time.monotonic())
+            return [
+                event for event in events
+                if event['id'] not in self._leases or self._leases[event['id']][0] == holder
+            ]
+
+
+slot_leases = SlotLeaseManager(ttl=float(os.getenv("SLOT_HOLD_TTL", "600")), store=shared_store)
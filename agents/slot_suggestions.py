@@ -0,0 +1,135 @@
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from dateutil import parser as date_parser
+import dotenv
+
+from .slot_leases import slot_leases
+from .tenants import business_zone, manager_pool
+
+dotenv.load_dotenv()
+
+SUGGEST_SLOTS = int(os.getenv("SUGGEST_SLOTS", "3"))
+SUGGEST_WINDOW_DAYS = int(os.getenv("SUGGEST_WINDOW_DAYS", "7"))
+# Hours of distance one hour of time-of-day difference is worth when ranking
+SUGGEST_TIME_OF_DAY_WEIGHT = float(os.getenv("SUGGEST_TIME_OF_DAY_WEIGHT", "2"))
+
+_ORDINALS = ["first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"]
+
+
+def _target(desired, tzinfo) -> datetime:
+    day = date_parser.parse(desired.min_date).date()
+    try:
+        at = date_parser.parse(desired.time).time()
+    except (ValueError, OverflowError):
+        at = datetime.min.time()
+    return datetime.combine(day, at, tzinfo=tzinfo)
+
+
+def _time_of_day_gap(a: datetime, b: datetime) -> float:
+    hours = abs((a.hour * 60 + a.minute) - (b.hour * 60 + b.minute)) / 60
+    return min(hours, 24 - hours)
+
+
+def rank_slots(slots: list[dict], desired, k=SUGGEST_SLOTS, now: datetime | None = None,
+               zone=None) -> list[dict]:
+    """
+    Pick the k open slots closest before and the k closest after a requested
+    appointment. Slots are ranked by their distance to the requested time plus
+    how far their time of day is from the requested one, so the same hour on
+    the next day can beat an early morning slot on the same day. The requested
+    date and time are read in the business's time zone.
+
+    Args:
+        slots (list): "Available" events with id, start and end
+        desired (DesiredAppointment): Requested date and time
+        k (int): Slots to pick on each side of the requested time
+        now (datetime): Slots starting before this are skipped (defaults to now)
+        zone (tzinfo): Time zone of the request (defaults to the tenant's)
+
+    Returns:
+        list: Up to 2k slots in chronological order
+    """
+    if not slots:
+        return []
+    starts = {slot['id']: date_parser.isoparse(slot['start']) for slot in slots}
+    zone = zone or business_zone()
+    target = _target(desired, zone)
+    now = now or datetime.now(timezone.utc)
+
+    def score(slot):
+        start = starts[slot['id']]
+        distance = abs((start - target).total_seconds()) / 3600
+        return distance + SUGGEST_TIME_OF_DAY_WEIGHT * _time_of_day_gap(start.astimezone(zone), target)
+
+    upcoming = [slot for slot in slots if starts[slot['id']] >= now]
+    before = sorted((s for s in upcoming if starts[s['id']] < target), key=score)[:k]
+    after = sorted((s for s in upcoming if starts[s['id']] >= target), key=score)[:k]
+    return sorted(before + after, key=lambda slot: starts[slot['id']])
+
+
+def nearest_slots(desired, holder: str | None = None, k=SUGGEST_SLOTS) -> list[dict]:
+    """
+    Fetch the open slots around a requested appointment and rank them, see rank_slots.
+    """
+    zone = business_zone()
+    target = _target(desired, zone)
+    window = timedelta(days=SUGGEST_WINDOW_DAYS)
+    with manager_pool.lease() as calendar_manager:
+        events = calendar_manager.get_events(time_min=target - window, time_max=target + window, max_results=250)
+    slots = slot_leases.filter_available([e for e in events if e['title'] == 'Available'], holder=holder)
+    return [
+        {'id': slot['id'], 'start': slot['start'], 'end': slot['end']}
+        for slot in rank_slots(slots, desired, k=k, zone=zone)
+    ]
+
+
+def format_suggestions(slots: list[dict]) -> str:
+    if not slots:
+        return "\n\nThere are no open slots around that time either. Would you like to try another week?"
+    zone = business_zone()
+    lines = []
+    for number, slot in enumerate(slots, start=1):
+        start = date_parser.isoparse(slot['start']).astimezone(zone)
+        end = date_parser.isoparse(slot['end']).astimezone(zone)
+        lines.append(f"{number}. {start.strftime('%A %b %d')}, {start.strftime('%H:%M')}-{end.strftime('%H:%M')}")
+    return "\n\nThe nearest open slots are:\n" + "\n".join(lines) + "\n\nReply with a number to book one, or ask for another time."
+
+
+def match_suggestion(user_input: str, slots: list[dict]) -> dict | None:
+    """
+    Find the suggested slot a reply picks. Only replies that are nothing but a
+    choice count: a number ("2", "option 2"), an ordinal ("the second one",
+    "the 2nd one") or a start time ("9:30", "3pm") matching exactly one slot.
+    Anything else, e.g. a reply that mentions a date or weekday, returns None
+    and is handled as a new request.
+    """
+    text = re.sub(r"(?:[\s,]+please)?[\s.!?,]*$", "", user_input.strip().lower())
+    number = re.fullmatch(r"(?:option|number|#)?\s*(\d{1,2})[.)]?", text)
+    if number:
+        index = int(number.group(1)) - 1
+        return slots[index] if 0 <= index < len(slots) else None
+    ordinal = re.fullmatch(r"(?:the\s+)?(\w+?)(\s+(?:one|slot|option))?", text)
+    if ordinal:
+        word = ordinal.group(1)
+        # "the 3rd" on its own is more likely a date than a choice
+        numeric = ordinal.group(2) and re.fullmatch(r"(\d{1,2})(?:st|nd|rd|th)", word)
+        index = int(numeric.group(1)) - 1 if numeric else (_ORDINALS.index(word) if word in _ORDINALS else None)
+        if index is not None:
+            return slots[index] if 0 <= index < len(slots) else None
+
+    at = re.fullmatch(r"(?:at\s+)?(\d{1,2})(?::(\d{2}))?\s*(am|pm)?", text)
+    if not at or (at.group(2) is None and at.group(3) is None):
+        return None
+    hour, minute = int(at.group(1)), int(at.group(2) or 0)
+    if at.group(3) == "am" and hour == 12:
+        hour = 0
+    elif at.group(3) == "pm" and hour < 12:
+        hour += 12
+    zone = business_zone()
+    matches = [
+        slot for slot in slots
+        if date_parser.isoparse(slot['start']).astimezone(zone).strftime('%H:%M') == f"{hour:02d}:{minute:02d}"
+    ]
+    return matches[0] if len(matches) == 1 else None
@@ -0,0 +1,53 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class SqliteDatabase:
+    def __init__(self, path: str, schema: str, synchronous: str | None = "NORMAL", row_factory=None):
+        """
+        SQLite file in WAL mode shared by threads and worker processes, with
+        one connection per thread.
+
+        Args:
+            path (str): SQLite database file
+            schema (str): Script creating the tables, run once on open
+            synchronous (str): `PRAGMA synchronous` level, None keeps SQLite's default
+            row_factory: Row factory of the connections (optional)
+        """
+        self.path = path
+        self.synchronous = synchronous
+        self.row_factory = row_factory
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(schema)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        if self.synchronous is not None:
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction on this thread's connection, rolled back if the block raises"""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
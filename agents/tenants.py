@@ -0,0 +1,199 @@
+import asyncio
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from datetime import timezone, tzinfo
+
+import dotenv
+from dateutil import tz
+
+from .google_calendar_manager import GoogleCalendarManager
+from .run_context import current_tenant_id, current_thread_id
+
+dotenv.load_dotenv()
+
+DEFAULT_TENANT_ID = "default"
+
+
+@dataclass
+class Tenant:
+    id: str
+    calendar_id: str
+    service_account_file: str = './client_secrets.json'
+    max_concurrency: int = 4
+    pool_size: int = 2
+    # IANA time zone of the business, days of availability searches start at its midnight
+    time_zone: str = "UTC"
+
+
+class TenantRegistry:
+    def __init__(self, tenants: list[Tenant], default_tenant_id: str, thread_routes: dict[str, str] | None = None):
+        """
+        Map sessions and threads to the tenant (calendar and credentials) they belong to.
+
+        Args:
+            tenants (list): Known tenants
+            default_tenant_id (str): Tenant used when a thread has no route
+            thread_routes (dict): Static thread ID -> tenant ID routes
+        """
+        self.tenants = {tenant.id: tenant for tenant in tenants}
+        self.default_tenant_id = default_tenant_id
+        self._thread_routes = dict(thread_routes or {})
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "TenantRegistry":
+        """
+        Load tenants from the JSON file in TENANTS_FILE, falling back to a
+        single tenant built from CALENDAR_ID.
+        """
+        tenants_file = os.getenv("TENANTS_FILE")
+        if not tenants_file:
+            tenant = Tenant(
+                id=DEFAULT_TENANT_ID,
+                calendar_id=os.getenv("CALENDAR_ID", "primary"),
+                time_zone=os.getenv("TIMEZONE", "UTC"),
+            )
+            return cls([tenant], DEFAULT_TENANT_ID)
+
+        with open(tenants_file) as f:
+            config = json.load(f)
+        tenants = [Tenant(**tenant) for tenant in config["tenants"]]
+        return cls(tenants, config.get("default", tenants[0].id), config.get("threads"))
+
+    def assign(self, thread_id: str, tenant_id: str):
+        """Route a thread to a tenant"""
+        if tenant_id not in self.tenants:
+            raise Exception(f"Unknown tenant: {tenant_id}")
+        with self._lock:
+            self._thread_routes[thread_id] = tenant_id
+
+    def resolve(self, tenant_id: str | None = None, thread_id: str | None = None) -> Tenant:
+        """
+        Find the tenant for an explicit tenant ID, a routed thread or the
+        current run context, in that order.
+        """
+        tenant_id = tenant_id or current_tenant_id.get()
+        if tenant_id is None:
+            thread_id = thread_id or current_thread_id.get()
+            with self._lock:
+                tenant_id = self._thread_routes.get(thread_id, self.default_tenant_id)
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None:
+            raise Exception(f"Unknown tenant: {tenant_id}")
+        return tenant
+
+
+class _TenantPool:
+    def __init__(self, tenant: Tenant):
+        self.tenant = tenant
+        self.semaphore = threading.BoundedSemaphore(tenant.max_concurrency)
+        # Async callers wait for a slot on their own event loop, see CalendarManagerPool.reserve
+        self.loop_semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = \
+            weakref.WeakKeyDictionary()
+        self.idle: list[GoogleCalendarManager] = []
+        self.leased = 0
+
+
+class CalendarManagerPool:
+    def __init__(self, registry: TenantRegistry, max_tenants=32):
+        """
+        Per-tenant pools of GoogleCalendarManager instances. The underlying
+        httplib2 client is not thread-safe, so a manager is only used by one
+        caller at a time. Pools of idle tenants are evicted LRU.
+
+        Args:
+            registry (TenantRegistry): Tenant lookup
+            max_tenants (int): Maximum number of tenant pools kept around
+        """
+        self.registry = registry
+        self.max_tenants = max_tenants
+        self._pools: OrderedDict[str, _TenantPool] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pool(self, tenant: Tenant) -> _TenantPool:
+        with self._lock:
+            pool = self._pools.get(tenant.id)
+            if pool is None:
+                pool = _TenantPool(tenant)
+                self._pools[tenant.id] = pool
+                self._evict()
+            self._pools.move_to_end(tenant.id)
+            pool.leased += 1
+            return pool
+
+    def _evict(self):
+        for tenant_id in list(self._pools):
+            if len(self._pools) <= self.max_tenants:
+                return
+            if self._pools[tenant_id].leased == 0:
+                del self._pools[tenant_id]
+
+    @contextmanager
+    def lease(self, tenant_id: str | None = None):
+        """
+        Borrow a calendar manager for the given or current tenant, waiting
+        while the tenant is at its concurrency limit.
+        """
+        tenant = self.registry.resolve(tenant_id)
+        pool = self._pool(tenant)
+        pool.semaphore.acquire()
+        manager = None
+        try:
+            with self._lock:
+                manager = pool.idle.pop() if pool.idle else None
+            if manager is None:
+                manager = GoogleCalendarManager(
+                    service_account_file=tenant.service_account_file,
+                    calendar_id=tenant.calendar_id
+                )
+            yield manager
+        finally:
+            with self._lock:
+                if manager is not None and len(pool.idle) < tenant.pool_size:
+                    pool.idle.append(manager)
+                pool.leased -= 1
+            pool.semaphore.release()
+
+    @asynccontextmanager
+    async def reserve(self, tenant_id: str | None = None):
+        """
+        Wait on the event loop while the given or current tenant is at its
+        concurrency limit. Async callers reserve a slot before starting a
+        blocking call that leases a manager, so a busy tenant queues here
+        instead of parking threads of the executor shared with other tenants.
+        """
+        tenant = self.registry.resolve(tenant_id)
+        pool = self._pool(tenant)
+        loop = asyncio.get_running_loop()
+        try:
+            with self._lock:
+                semaphore = pool.loop_semaphores.get(loop)
+                if semaphore is None:
+                    semaphore = pool.loop_semaphores[loop] = asyncio.Semaphore(tenant.max_concurrency)
+            async with semaphore:
+                yield
+        finally:
+            with self._lock:
+                pool.leased -= 1
+
+    async def call(self, fn, *args, tenant_id: str | None = None):
+        """
+        Run a blocking function that leases a calendar manager in a worker
+        thread, once the tenant has a free slot.
+        """
+        async with self.reserve(tenant_id):
+            return await asyncio.to_thread(fn, *args)
+
+
+tenant_registry = TenantRegistry.from_env()
+manager_pool = CalendarManagerPool(tenant_registry, max_tenants=int(os.getenv("MAX_TENANT_POOLS", "32")))
+
+
+def business_zone() -> tzinfo:
+    """Time zone of the current tenant's business, UTC when it is unknown"""
+    return tz.gettz(tenant_registry.resolve().time_zone) or timezone.utc
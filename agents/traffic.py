@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import dotenv
+import httplib2
+from pydantic_ai.messages import ModelMessagesTypeAdapter, ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+from pydantic_ai.models.wrapper import WrapperModel
+
+from .run_context import current_thread_id
+
+dotenv.load_dotenv()
+
+# off, record or replay
+TRAFFIC_MODE = os.getenv("TRAFFIC_MODE", "off")
+TRAFFIC_DIR = os.getenv("TRAFFIC_DIR", "./recordings")
+
+# Only Calendar API traffic is recorded, never OAuth token exchanges
+CALENDAR_API_PREFIX = "https://www.googleapis.com/calendar/"
+
+UNBOUND_THREAD = "_unbound"
+
+
+def cache_ttl(name: str, default: str) -> float:
+    """
+    TTL of a process-wide cache from the env var `name`. Caches are off while
+    recording or replaying: a read served to one thread from another thread's
+    call would be missing from its recording.
+    """
+    if TRAFFIC_MODE in ("record", "replay"):
+        return 0.0
+    return float(os.getenv(name, default))
+
+
+def _thread_key() -> str:
+    return current_thread_id.get() or UNBOUND_THREAD
+
+
+def _calendar_key(method: str, uri: str) -> str:
+    # Query strings carry timeMin and other values derived from the clock
+    return f"{method} {urlsplit(uri).path}"
+
+
+class TrafficRecorder:
+    def __init__(self, directory=TRAFFIC_DIR):
+        """
+        Append the model responses, Calendar responses and turns of every
+        conversation to `<directory>/<thread_id>.jsonl`.
+
+        Args:
+            directory (str): Directory of the recordings
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def write(self, thread_id: str, entry: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(os.path.join(self.directory, f"{thread_id}.jsonl"), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def record_model(self, agent: str, response: ModelResponse):
+        self.write(_thread_key(), {
+            "kind": "model",
+            "agent": agent,
+            "response": json.loads(ModelMessagesTypeAdapter.dump_json([response]))[0],
+        })
+
+    def record_calendar(self, method: str, uri: str, status: int, headers: dict, content: bytes):
+        self.write(_thread_key(), {
+            "kind": "calendar",
+            "key": _calendar_key(method, uri),
+            "status": status,
+            "headers": headers,
+            "content": content.decode("utf-8"),
+        })
+
+    def record_turn(self, thread_id: str, tenant_id: str | None, user_input: str, response: str, latency: float):
+        self.write(thread_id, {
+            "kind": "turn",
+            "tenant_id": tenant_id,
+            "user_input": user_input,
+            "response": response,
+            "latency": latency,
+        })
+
+
+class TrafficReplayer:
+    def __init__(self, directory=TRAFFIC_DIR):
+        """
+        Serve recorded responses back per thread, in the order they were recorded.
+
+        Args:
+            directory (str): Directory of the recordings
+        """
+        self.directory = directory
+        self._threads: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def reset(self, thread_id: str):
+        """Serve a thread's responses from the start again"""
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def _load(self, thread_id: str) -> dict:
+        with self._lock:
+            recording = self._threads.get(thread_id)
+            if recording is not None:
+                return recording
+            recording = {"model": defaultdict(deque), "calendar": defaultdict(deque), "last_calendar": {}}
+            path = os.path.join(self.directory, f"{thread_id}.jsonl")
+            if os.path.exists(path):
+                with open(path) as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        if entry["kind"] == "model":
+                            recording["model"][entry["agent"]].append(entry["response"])
+                        elif entry["kind"] == "calendar":
+                            recording["calendar"][entry["key"]].append(entry)
+            self._threads[thread_id] = recording
+            return recording
+
+    def turns(self, thread_id: str) -> list[dict]:
+        """User turns of a recorded conversation"""
+        with open(os.path.join(self.directory, f"{thread_id}.jsonl")) as f:
+            return [entry for entry in map(json.loads, f) if entry["kind"] == "turn"]
+
+    def thread_ids(self) -> list[str]:
+        return sorted(
+            name[:-len(".jsonl")] for name in os.listdir(self.directory)
+            if name.endswith(".jsonl") and name != f"{UNBOUND_THREAD}.jsonl"
+        )
+
+    def next_model_response(self, agent: str) -> ModelResponse:
+        thread_id = _thread_key()
+        queue = self._load(thread_id)["model"][agent]
+        if not queue:
+            raise Exception(f"No recorded {agent} response left for thread {thread_id}")
+        return ModelMessagesTypeAdapter.validate_python([queue.popleft()])[0]
+
+    def next_calendar_response(self, method: str, uri: str) -> dict:
+        thread_id = _thread_key()
+        recording = self._load(thread_id)
+        key = _calendar_key(method, uri)
+        with self._lock:
+            queue = recording["calendar"][key]
+            if queue:
+                recording["last_calendar"][key] = queue.popleft()
+            # Caches may skip or repeat reads compared to the recording; repeat the last response
+            entry = recording["last_calendar"].get(key)
+        if entry is None:
+            raise Exception(f"No recorded Calendar response for {key} on thread {thread_id}")
+        return entry
+
+
+recorder = TrafficRecorder()
+replayer = TrafficReplayer()
+
+
+class RecordingModel(WrapperModel):
+    """Model that records every response it returns"""
+
+    def __init__(self, wrapped, agent: str):
+        super().__init__(wrapped)
+        self.agent = agent
+
+    async def request(self, *args, **kwargs) -> ModelResponse:
+        response = await super().request(*args, **kwargs)
+        recorder.record_model(self.agent, response)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(self, *args, **kwargs):
+        async with super().request_stream(*args, **kwargs) as response_stream:
+            yield response_stream
+        recorder.record_model(self.agent, response_stream.get())
+
+
+def replay_model(agent: str) -> FunctionModel:
+    """FunctionModel that answers with the recorded responses of an agent"""
+
+    def respond(messages, info) -> ModelResponse:
+        return replayer.next_model_response(agent)
+
+    async def stream(messages, info):
+        response = replayer.next_model_response(agent)
+        for index, part in enumerate(response.parts):
+            if isinstance(part, TextPart):
+                yield part.content
+            elif isinstance(part, ToolCallPart):
+                yield {index: DeltaToolCall(name=part.tool_name, json_args=part.args_as_json_str(),
+                                            tool_call_id=part.tool_call_id)}
+
+    return FunctionModel(respond, stream_function=stream, model_name=f"replay:{agent}")
+
+
+class RecordingHttp(httplib2.Http):
+    """httplib2 transport that records Calendar API responses"""
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        response, content = super().request(uri, method, body, headers, *args, **kwargs)
+        if uri.startswith(CALENDAR_API_PREFIX):
+            recorder.record_calendar(method, uri, response.status, dict(response), content)
+        return response, content
+
+
+class ReplayHttp:
+    """Stand-in httplib2 transport that answers with recorded Calendar API responses"""
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        entry = replayer.next_calendar_response(method, uri)
+        response = httplib2.Response({**entry["headers"], "status": str(entry["status"])})
+        return response, entry["content"].encode("utf-8")
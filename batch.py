@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+
+import logfire
+
+from agents.booking_outbox import booking_outbox, DONE, FAILED
+from agents.rate_limiter import rate_limiter
+from agents.slot_leases import slot_leases
+from graph import graph
+from turns import turn_registry
+from workers import Dispatcher
+
+# Interrupts that wait for an appointment time and for contact details
+TIME_INTERRUPTS = ("wait_message",)
+CONTACT_INTERRUPTS = ("wait_for_user_details",)
+
+
+def read_records(path: str) -> list[dict]:
+    """
+    Read booking requests, one JSON object per line:
+
+        {"id": "r1", "message": "I need an appointment", "date": "2025-09-01", "time": "10:00",
+         "full_name": "Ada Lovelace", "email": "ada@example.com", "phone_number": "555-0100",
+         "tenant_id": "acme", "replies": ["Any time after 3pm works too"]}
+
+    Only `message` is required. `date`/`time` answer a question about the
+    appointment time, the contact fields answer the contact question, and
+    `replies` are used in order once those have been sent.
+    """
+    records = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault("id", str(line_number))
+            records.append(record)
+    return records
+
+
+def _time_reply(record: dict) -> str | None:
+    if not record.get("date") and not record.get("time"):
+        return None
+    parts = ["I'd like an appointment"]
+    if record.get("date"):
+        parts.append(f"on {record['date']}")
+    if record.get("time"):
+        parts.append(f"at {record['time']}")
+    return " ".join(parts)
+
+
+def _contact_reply(record: dict) -> str | None:
+    if not record.get("full_name") or not record.get("email"):
+        return None
+    reply = f"My name is {record['full_name']}, my email is {record['email']}"
+    if record.get("phone_number"):
+        reply += f" and my phone number is {record['phone_number']}"
+    return reply
+
+
+class _Replies:
+    """Answers to the graph's interrupts taken from the fields of a record"""
+
+    def __init__(self, record: dict):
+        self.time = _time_reply(record)
+        self.contact = _contact_reply(record)
+        self.extra = list(record.get("replies", []))
+
+    def next(self, waiting_on: tuple) -> str | None:
+        if any(node in TIME_INTERRUPTS for node in waiting_on) and self.time:
+            reply, self.time = self.time, None
+            return reply
+        if any(node in CONTACT_INTERRUPTS for node in waiting_on) and self.contact:
+            reply, self.contact = self.contact, None
+            return reply
+        return self.extra.pop(0) if self.extra else None
+
+
+async def _wait_for_booking(thread_id: str, timeout: float) -> dict | None:
+    deadline = time.monotonic() + timeout
+    while True:
+        bookings = booking_outbox.bookings_for_thread(thread_id)
+        booking = bookings[-1] if bookings else None
+        if booking is None or booking["status"] in (DONE, FAILED) or time.monotonic() >= deadline:
+            return booking
+        await asyncio.sleep(0.2)
+
+
+async def run_record(record: dict, max_turns=8, wait_for_booking=0.0, dispatcher=None) -> dict:
+    """
+    Drive one booking request through the graph on its own thread.
+
+    Args:
+        record (dict): Booking request, see read_records
+        max_turns (int): Turns allowed before giving up
+        wait_for_booking (float): Seconds to wait for the background booking to finish
+        dispatcher (Dispatcher): Run the turns on worker processes instead of in this process
+
+    Returns:
+        dict: Result row with status, booking details, turns and latency
+    """
+    thread_id = record.get("thread_id") or f"batch-{record['id']}-{uuid.uuid4().hex[:8]}"
+    config = {"configurable": {"thread_id": thread_id, "tenant_id": record.get("tenant_id")}}
+    replies = _Replies(record)
+    transcript = []
+    result = {"id": record["id"], "thread_id": thread_id}
+    started = time.perf_counter()
+
+    try:
+        user_input = record["message"]
+        for _ in range(max_turns):
+            initial_state = {"messages": [], "user_input": user_input, "contact_information": {}}
+            if dispatcher is not None:
+                stream = dispatcher.run(config, user_input)
+            else:
+                stream = turn_registry.run(graph, config, user_input, initial_state)
+            response = ""
+            async for chunk in stream:
+                response += chunk
+            transcript.append({"user": user_input, "assistant": response})
+
+            snapshot = await graph.aget_state(config)
+            if not snapshot.next:
+                break
+            user_input = replies.next(snapshot.next)
+            if user_input is None:
+                break
+        result["latency_s"] = round(time.perf_counter() - started, 3)
+
+        booking = await _wait_for_booking(thread_id, wait_for_booking)
+        if booking is not None:
+            status = booking["status"]
+            result.update(event_id=booking["event_id"], error=booking["error"] or "")
+            if booking["result"]:
+                result["link"] = json.loads(booking["result"]).get("link") or ""
+        elif snapshot.next:
+            status = "needs_input" if len(transcript) < max_turns else "max_turns"
+            # Don't keep a slot from the other records
+            selected = snapshot.values.get("selected_appointment")
+            if selected is not None:
+                slot_leases.release(selected.id, thread_id)
+        else:
+            status = "not_booked"
+    except Exception as e:
+        logfire.error("Batch record {id} failed: {error}", id=record["id"], error=str(e))
+        status = "error"
+        result.setdefault("latency_s", round(time.perf_counter() - started, 3))
+        result["error"] = str(e)
+
+    result.update(status=status, turns=len(transcript), transcript=transcript)
+    return result
+
+
+async def run_batch(records: list[dict], output_path: str, concurrency=8, max_turns=8, wait_for_booking=0.0,
+                    dispatcher=None) -> list[dict]:
+    """
+    Run booking requests concurrently, writing each result to a JSONL file as soon as it finishes.
+
+    Args:
+        records (list): Booking requests
+        output_path (str): Results file
+        concurrency (int): Records in flight at once
+        max_turns (int): Turns allowed per record
+        wait_for_booking (float): Seconds to wait for each background booking to finish
+        dispatcher (Dispatcher): Run the turns on worker processes instead of in this process
+
+    Returns:
+        list: Result rows in completion order
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(record):
+        async with semaphore:
+            return await run_record(record, max_turns=max_turns, wait_for_booking=wait_for_booking,
+                                    dispatcher=dispatcher)
+
+    results = []
+    with open(output_path, "w") as out:
+        for task in asyncio.as_completed([bounded(record) for record in records]):
+            result = await task
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            results.append(result)
+            logfire.info("Batch record {id}: {status} in {latency_s}s",
+                         id=result["id"], status=result["status"], latency_s=result["latency_s"])
+    return results
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+    latencies = sorted(r["latency_s"] for r in results)
+    statuses = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    return {
+        "records": len(results),
+        "elapsed_s": round(elapsed, 3),
+        "statuses": statuses,
+        "latency_p50_s": statistics.median(latencies) if latencies else 0.0,
+        "latency_p95_s": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        "calendar_api": rate_limiter.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Book appointments in bulk from a JSONL file of requests")
+    parser.add_argument("input", help="JSONL file with one booking request per line")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL file for per-record results")
+    parser.add_argument("--concurrency", type=int, default=8, help="Records processed at once")
+    parser.add_argument("--max-turns", type=int, default=8, help="Turns allowed per record")
+    parser.add_argument("--calendar-qps", type=float, help="Calendar API requests per second shared by the whole batch")
+    parser.add_argument("--per-calendar-qps", type=float, help="Calendar API requests per second for each calendar")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Graph worker processes (needs CHECKPOINT_STORE=sqlite and SHARED_STATE_PATH)")
+    parser.add_argument("--wait-for-booking", type=float, default=30.0,
+                        help="Seconds to wait for each background booking to be applied (0 to skip)")
+    args = parser.parse_args()
+
+    # Every process has its own rate limiter: this one applies the bookings and each
+    # worker process runs graphs, so they all get an equal share of the budget
+    processes = args.workers + 1
+    global_qps = args.calendar_qps / processes if args.calendar_qps is not None else None
+    calendar_qps = args.per_calendar_qps / processes if args.per_calendar_qps is not None else None
+    rate_limiter.configure(global_qps=global_qps, calendar_qps=calendar_qps)
+    # Bookings are applied by this process only, worker processes just enqueue them
+    booking_outbox.start()
+    dispatcher = None
+    if args.workers:
+        for name, qps in (("CALENDAR_GLOBAL_QPS", global_qps), ("CALENDAR_PER_CALENDAR_QPS", calendar_qps)):
+            if qps is not None:
+                os.environ[name] = str(qps)
+        dispatcher = Dispatcher(args.workers)
+
+    started = time.perf_counter()
+    results = asyncio.run(run_batch(
+        read_records(args.input),
+        args.output,
+        concurrency=args.concurrency,
+        max_turns=args.max_turns,
+        wait_for_booking=args.wait_for_booking,
+        dispatcher=dispatcher,
+    ))
+    if dispatcher is not None:
+        dispatcher.stop()
+    booking_outbox.stop()
+    print(json.dumps(summarize(results, time.perf_counter() - started), indent=2))
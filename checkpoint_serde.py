@@ -0,0 +1,129 @@
+import os
+from dataclasses import fields
+from typing import Any
+
+import ormsgpack
+import zstandard
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from agents.calendar_availability import SelectedAppointment, NoAvailableSlots
+from agents.gather_information import DesiredAppointment
+from agents.set_meeting_details import MeetingDetails
+
+COMPACT_TYPE = "msgpack-compact"
+COMPRESSED_TYPE = "msgpack-compact+zstd"
+# Values smaller than this are not worth a zstd frame header
+COMPRESSION_THRESHOLD = int(os.getenv("CHECKPOINT_COMPRESSION_THRESHOLD", "512"))
+
+_PACK_OPTIONS = (
+    ormsgpack.OPT_NON_STR_KEYS
+    | ormsgpack.OPT_PASSTHROUGH_DATACLASS
+    | ormsgpack.OPT_PASSTHROUGH_DATETIME
+)
+
+# Extension codes of the graph state types. Fields are stored positionally,
+# so only append new fields at the end of these classes.
+_FALLBACK_CODE = 0
+_CODECS: dict[int, type] = {
+    1: SelectedAppointment,
+    2: NoAvailableSlots,
+    3: MeetingDetails,
+    4: DesiredAppointment,
+}
+_CODES = {cls: code for code, cls in _CODECS.items()}
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """
+    Checkpoint serializer that packs the graph state types as positional
+    msgpack extensions and compresses large values with zstd. Anything else
+    is delegated to the default JsonPlusSerializer, which also keeps
+    checkpoints written before this serializer readable.
+    """
+
+    def __init__(self, compression_level: int = 3):
+        super().__init__()
+        self._compressor = zstandard.ZstdCompressor(level=compression_level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if obj is None or isinstance(obj, (bytes, bytearray)) and len(obj) < COMPRESSION_THRESHOLD:
+            return super().dumps_typed(obj)
+        data = ormsgpack.packb(obj, default=self._default, option=_PACK_OPTIONS)
+        if len(data) < COMPRESSION_THRESHOLD:
+            return COMPACT_TYPE, data
+        return COMPRESSED_TYPE, self._compressor.compress(data)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, data_ = data
+        if type_ == COMPRESSED_TYPE:
+            data_ = self._decompressor.decompress(data_)
+        elif type_ != COMPACT_TYPE:
+            return super().loads_typed(data)
+        return ormsgpack.unpackb(data_, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+
+    def _default(self, obj: Any):
+        code = _CODES.get(type(obj))
+        if code is None:
+            return ormsgpack.Ext(_FALLBACK_CODE, ormsgpack.packb(list(super().dumps_typed(obj))))
+        if code == _CODES[DesiredAppointment]:
+            values = [obj.min_date, obj.max_date, obj.time]
+        else:
+            values = [getattr(obj, field.name) for field in fields(obj)]
+        return ormsgpack.Ext(code, ormsgpack.packb(values, default=self._default, option=_PACK_OPTIONS))
+
+    def _ext_hook(self, code: int, data: bytes):
+        values = ormsgpack.unpackb(data, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+        if code == _FALLBACK_CODE:
+            return super().loads_typed(tuple(values))
+        cls = _CODECS[code]
+        if cls is DesiredAppointment:
+            min_date, max_date, time = values
+            return DesiredAppointment.model_construct(min_date=min_date, max_date=max_date, time=time)
+        return cls(*values)
+
+
+def get_serializer():
+    """Serializer selected by CHECKPOINT_SERDE ("compact" or the LangGraph default)"""
+    if os.getenv("CHECKPOINT_SERDE", "default") == "compact":
+        return CompactSerializer()
+    return JsonPlusSerializer()
+
+
+def benchmark(iterations: int = 2000):
+    """
+    Compare checkpoint size and serialization time per step against the
+    default serializer on a representative graph state.
+    """
+    import time
+    from pydantic_ai.messages import ModelMessagesTypeAdapter, ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+    history = []
+    for i in range(10):
+        history.append(ModelRequest(parts=[UserPromptPart(content=f"I'd like an appointment on the {i + 1}th at 10")]))
+        history.append(ModelResponse(parts=[TextPart(content="Let me check if that time is available for you. " * 4)]))
+    appointment = SelectedAppointment(id="3pvnq212mnaom093nn9rpoe0oc")
+    state = {
+        "messages": [ModelMessagesTypeAdapter.dump_json(history[i:i + 2]) for i in range(0, len(history), 2)],
+        "user_input": "my name is wonder and my email is test@gmail.com",
+        "user_requirements": DesiredAppointment(min_date="2025-08-28", max_date="2025-08-28", time="10:00"),
+        "selected_appointment": appointment,
+        "meeting_details": MeetingDetails("Wonder", "test@gmail.com", "+123345678", appointment),
+    }
+
+    for serde in (JsonPlusSerializer(), CompactSerializer()):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            dumped = {key: serde.dumps_typed(value) for key, value in state.items()}
+        dump_time = (time.perf_counter() - started) / iterations
+        started = time.perf_counter()
+        for _ in range(iterations):
+            loaded = {key: serde.loads_typed(value) for key, value in dumped.items()}
+        load_time = (time.perf_counter() - started) / iterations
+        assert loaded == state
+        size = sum(len(data) for _, data in dumped.values())
+        print(f"{type(serde).__name__:>20}: {size:>6} bytes, dumps {dump_time * 1e6:8.1f}us, loads {load_time * 1e6:8.1f}us per step")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,7 +1,11 @@
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
+
+from checkpoint_serde import get_serializer
+from checkpoint_store import get_checkpointer
 
 from agents.calendar_availability import SelectedAppointment
+from agents.booking_outbox import booking_outbox
+from agents.slot_leases import slot_leases
 from nodes import (
     State,
     ask_user_for_another_time,
@@ -10,7 +14,9 @@ from nodes import (
     calendar_availability_node,
     gather_contact_information_node,
     non_selected_appt_router,
+    pick_suggested_slot_node,
     set_meeting_details_node,
+    suggested_slot_router,
     user_data_router,
     verify_user_date_node
 )
@@ -47,7 +53,9 @@ def build_graph():
     graph_builder.add_node("set_meeting_details", set_meeting_details_node)
 
     graph_builder.add_edge(START, "gather_information")
-    graph_builder.add_edge("wait_message", "gather_information")
+    graph_builder.add_node("pick_suggested_slot", pick_suggested_slot_node)
+    graph_builder.add_edge("wait_message", "pick_suggested_slot")
+    graph_builder.add_conditional_edges("pick_suggested_slot", suggested_slot_router, ["gather_contact_information", "gather_information"])
 
     graph_builder.add_conditional_edges("gather_information", verify_user_date_node,["calendar_availability", "wait_message"])
 
@@ -58,12 +66,21 @@ def build_graph():
 
     graph_builder.add_edge("set_meeting_details", END)
 
-    memory = MemorySaver()
+    checkpointer = get_checkpointer(serde=get_serializer())
 
-    return graph_builder.compile(checkpointer=memory)
+    return graph_builder.compile(checkpointer=checkpointer)
 
 graph = build_graph()
 
+def release_booked_slot(booking: dict):
+    """
+    The slot of a finished booking is either booked now or lost, so stop holding it.
+    """
+    if booking["thread_id"]:
+        slot_leases.release(booking["event_id"], booking["thread_id"])
+
+booking_outbox.add_listener(release_booked_slot)
+
 async def run_agent(usr_input: str):
     initial_state = {
         "messages": [],
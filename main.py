@@ -1,11 +1,16 @@
-from langgraph.types import Command
 from typing import List, Dict
 from datetime import datetime
 import streamlit as st
 import asyncio
+import os
 import uuid
 
+from agents.booking_outbox import booking_outbox, booking_status, DONE, FAILED
+from agents.calendar_watch import start_from_env as start_calendar_watch
+from agents.tenants import tenant_registry
 from graph import graph
+from turns import turn_registry
+from workers import Dispatcher
 
 
 # Page configuration
@@ -32,6 +37,29 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Messages rendered per page of history, older ones are paged in on demand (0 renders everything)
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "20"))
+
+# PNGs are served from Streamlit's media endpoint under a stable URL the browser caches,
+# instead of being fetched from a remote service or inlined like SVGs on every rerun
+AVATARS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "avatars")
+USER_AVATAR = os.path.join(AVATARS_DIR, "user.png")
+ASSISTANT_AVATAR = os.path.join(AVATARS_DIR, "assistant.png")
+
+@st.cache_resource
+def start_background_services():
+    # Once per app: the booking outbox applies bookings made by any process,
+    # and the webhook receiver binds its port and opens the watch channels
+    booking_outbox.start()
+    return start_calendar_watch()
+
+start_background_services()
+
+@st.cache_resource
+def get_dispatcher():
+    # Worker processes shared by every session, when GRAPH_WORKERS is set
+    return Dispatcher.from_env()
+
 @st.cache_resource
 def get_thread_id():
     return str(uuid.uuid4())
@@ -48,6 +76,20 @@ if "thread_id" not in st.session_state:
 if "processing_message" not in st.session_state:
     st.session_state.processing_message = None
 
+if "history_pages" not in st.session_state:
+    st.session_state.history_pages = 1
+
+def show_earlier_messages():
+    st.session_state.history_pages += 1
+
+def visible_history() -> tuple[int, List[Dict]]:
+    """Number of hidden older messages and the recent window of the chat history to render"""
+    history = st.session_state.chat_history
+    if CHAT_WINDOW <= 0:
+        return 0, history
+    shown = CHAT_WINDOW * st.session_state.history_pages
+    return max(len(history) - shown, 0), history[-shown:]
+
 # Function to handle user input
 def handle_user_message(user_input: str):
     # Add user message to chat history immediately
@@ -61,6 +103,45 @@ def handle_user_message(user_input: str):
     # Set the message for processing in the next rerun
     st.session_state.processing_message = user_input
 
+def get_graph_config():
+    # Businesses are selected with the `tenant` query parameter, e.g. ?tenant=acme
+    tenant_id = st.query_params.get("tenant")
+    if tenant_id is not None and tenant_id not in tenant_registry.tenants:
+        # Refuse here rather than failing inside the graph on the first calendar call
+        st.error(f"Unknown business: {tenant_id}")
+        st.stop()
+    return {"configurable": {"thread_id": st.session_state.thread_id, "tenant_id": tenant_id}}
+
+@st.fragment(run_every="3s")
+def booking_notifications():
+    """
+    Poll the outbox for the outcome of a booking applied in the background.
+    The outbox is the source of truth: a running turn can't overwrite it.
+    """
+    bookings = booking_outbox.bookings_for_thread(get_graph_config()["configurable"]["thread_id"])
+    booking = bookings[-1] if bookings else None
+    if booking is None or booking["status"] not in (DONE, FAILED):
+        return
+    # A failed booking retried in the same conversation keeps its row, updated_at tells the outcomes apart
+    notified = (booking["id"], booking["status"], booking["updated_at"])
+    if st.session_state.get("booking_notified") == notified:
+        return
+    st.session_state.booking_notified = notified
+    status = booking_status(booking)
+
+    if status["status"] == "done":
+        content = "Your appointment is confirmed!"
+        if status["link"]:
+            content += f" {status['link']}"
+    else:
+        content = f"Sorry, we couldn't book that slot: {status['error']}"
+    st.session_state.chat_history.append({
+        "role": "assistant",
+        "content": content,
+        "timestamp": datetime.now().strftime("%I:%M %p")
+    })
+    st.rerun(scope="app")
+
 # Function to invoke the agent graph to interact with the Travel Planning Agent
 async def invoke_agent_graph(user_input: str):
     """
@@ -72,14 +153,14 @@ async def invoke_agent_graph(user_input: str):
           "user_input": user_input,
           "contact_information": {}
       }
-    config = {"configurable": {"thread_id": "1"}}
-    if len(st.session_state.chat_history) == 2:
-
-     async for chunk in graph.astream(initial_state, stream_mode="custom", config=config):
-          yield chunk
+    # A newer message on the same thread cancels this turn and rolls it back
+    dispatcher = get_dispatcher()
+    if dispatcher is not None:
+        stream = dispatcher.run(get_graph_config(), user_input)
     else:
-        async for chunk in graph.astream(Command(resume=user_input), stream_mode="custom", config=config):
-            yield chunk
+        stream = turn_registry.run(graph, get_graph_config(), user_input, initial_state)
+    async for chunk in stream:
+        yield chunk
 
 async def main():
     # Sidebar
@@ -93,20 +174,24 @@ async def main():
         if st.button("Start New Conversation"):
             st.session_state.chat_history = []
             st.session_state.thread_id = str(uuid.uuid4())
+            st.session_state.history_pages = 1
             st.success("New conversation started!")
 
     # Main chat interface
     st.title("📅 Appointment Scheduler")
     st.caption("Tell me about your appointment needs and I'll help schedule it!")
 
-    # Display chat messages
-    for message in st.session_state.chat_history:
+    # Display the recent chat messages, older ones stay collapsed until asked for
+    hidden, messages = visible_history()
+    if hidden:
+        st.button(f"Show {min(hidden, CHAT_WINDOW)} earlier messages", on_click=show_earlier_messages)
+    for message in messages:
         if message["role"] == "user":
-            with st.chat_message("user", avatar=f"https://api.dicebear.com/7.x/avataaars/svg?seed={st.session_state.thread_id}"):
+            with st.chat_message("user", avatar=USER_AVATAR):
                 st.markdown(message["content"])
                 st.caption(message["timestamp"])
         else:
-            with st.chat_message("assistant", avatar="https://api.dicebear.com/7.x/bottts/svg?seed=travel-agent"):
+            with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
                 st.markdown(message["content"])
                 st.caption(message["timestamp"])
 
@@ -124,28 +209,22 @@ async def main():
         # Process the message asynchronously
         with st.spinner("Thinking..."):
             try:
-                # Prepare input for the agent using chat history
-                if len(st.session_state.chat_history) > 1:
-                    # Convert chat history to input list format for the agent
-                    input_list = []
-                    for msg in st.session_state.chat_history:
-                        input_list.append({"role": msg["role"], "content": msg["content"]})
-                else:
-                    # First message
-                    input_list = user_input
-
                 # Display assistant response in chat message container
                 response_content = ""
                 
                 # Create a chat message container using Streamlit's built-in component
-                with st.chat_message("assistant", avatar="https://api.dicebear.com/7.x/bottts/svg?seed=travel-agent"):
+                with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
                     message_placeholder = st.empty()
                     
                     # Run the async generator to fetch responses
-                    async for chunk in invoke_agent_graph(user_input):
-                        response_content += chunk
-                        # Update only the text content
-                        message_placeholder.markdown(response_content)
+                    try:
+                        async for chunk in invoke_agent_graph(user_input):
+                            response_content += chunk
+                            # Update only the text content
+                            message_placeholder.markdown(response_content)
+                    except asyncio.CancelledError:
+                        # Superseded by a newer message, which gets the answer instead
+                        return
                 
                 # Add assistant response to chat history
                 st.session_state.chat_history.append({
@@ -166,6 +245,8 @@ async def main():
             # Force a rerun to display the AI response
             # st.rerun()
 
+    booking_notifications()
+
     # Footer
     st.divider()
     st.caption("Powered by Pydantic AI and LangGraph")
@@ -1,14 +1,25 @@
 
+from collections import defaultdict, deque
 from typing import Annotated, Dict, List, TypedDict, Literal
+import asyncio
+import time
+import logfire
 from pydantic_ai import Agent
-from pydantic_graph import End
-from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter, PartDeltaEvent, PartStartEvent, ToolCallPartDelta, ToolCallPart
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter, ModelResponse, PartDeltaEvent, PartStartEvent, TextPart, ToolCallPartDelta, ToolCallPart
 from langgraph.config import get_stream_writer
+from langchain_core.runnables import RunnableConfig
 from langgraph.types import interrupt, Command
 from agents.gather_information import gather_information_agent, DesiredAppointment
 from agents.calendar_availability import calendar_availability_agent, SelectedAppointment
 from agents.gather_contact_information import gather_contact_information_agent
 from agents.set_meeting_details import set_meeting_details_agent, MeetingDetails
+from agents.run_context import bind_run_context
+from agents.deadlines import node_deadline
+from agents.slot_leases import slot_leases
+from agents.availability_memo import availability_memo
+from agents.response_cache import response_cache
+from agents.slot_suggestions import nearest_slots, format_suggestions, match_suggestion
+from agents.tenants import manager_pool, tenant_registry
 
 class State(TypedDict):
     messages: Annotated[List[bytes], lambda x, y: x + y]
@@ -17,6 +28,7 @@ class State(TypedDict):
     user_input: str
     user_requirements: DesiredAppointment
     meeting_details: MeetingDetails
+    suggested_slots: List[Dict[str, str]]
 
 async def handle_event(event, writer):
     """
@@ -37,57 +49,255 @@ async def process_stream(request_stream, writer):
     async for event in request_stream:
         await handle_event(event, writer)
 
-async def gather_info_node(state: State,) -> Dict[str, str]:
+class TimedWriter:
+    """
+    Stream writer that records the time to first token of a node.
+    """
+    def __init__(self, node_name: str, writer):
+        self.node_name = node_name
+        self.writer = writer
+        self.started_at = time.perf_counter()
+        self.time_to_first_token = None
+
+    def __call__(self, chunk):
+        if self.time_to_first_token is None and chunk:
+            self.time_to_first_token = time.perf_counter() - self.started_at
+            ttft_samples[self.node_name].append(self.time_to_first_token)
+            logfire.info("{node} time to first token: {ttft:.3f}s", node=self.node_name, ttft=self.time_to_first_token)
+        self.writer(chunk)
+
+# Recent time-to-first-token samples per node, in seconds
+ttft_samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=1000))
+
+def ttft_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Median and p95 time to first token of each node over the recent samples.
+    """
+    stats = {}
+    for node_name, samples in ttft_samples.items():
+        ordered = sorted(samples)
+        if ordered:
+            stats[node_name] = {
+                "count": len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            }
+    return stats
+
+async def stream_agent_run(agent, writer, **kwargs):
+    """
+    Run an agent, streaming the text of every model response through `writer`,
+    and return the run result with its structured output.
+    """
+    async with agent.iter(**kwargs) as run:
+        async for node in run:
+            if Agent.is_model_request_node(node):
+                async with node.stream(run.ctx) as request_stream:
+                    await process_stream(request_stream, writer)
+    return run.result
+
+class CachedRun:
+    """
+    Agent run result served from the response cache.
+    """
+    def __init__(self, output, messages_json: bytes):
+        self.output = output
+        self.messages_json = messages_json
+
+    def new_messages_json(self) -> bytes:
+        return self.messages_json
+
+async def cached_agent_run(agent_name: str, agent, writer, cacheable: tuple, **kwargs):
+    """
+    Like `stream_agent_run`, but inputs already answered in the same context
+    are served from the response cache, replaying the streamed text. Only
+    outputs of the `cacheable` types are cached, not follow-up questions.
+    """
+    key = response_cache.key(agent_name, kwargs.get("user_prompt") or "", kwargs.get("message_history") or [], kwargs.get("deps"))
+    cached = response_cache.get(key)
+    if cached is not None:
+        output, text, messages_json = cached
+        if text:
+            writer(text)
+        return CachedRun(output, messages_json)
+
+    chunks = []
+    def capture(chunk):
+        chunks.append(chunk)
+        writer(chunk)
+
+    result = await stream_agent_run(agent, capture, **kwargs)
+    if isinstance(result.output, cacheable):
+        response_cache.put(key, (result.output, "".join(chunks), result.new_messages_json()))
+    return result
+
+DEADLINE_MESSAGE = "Sorry, this is taking longer than expected. Please try again in a moment."
+
+def with_deadline(node_name: str, fallback: Dict):
+    """
+    Bound the run time of a node. On timeout the user gets a short message
+    and the node returns `fallback`, which routes the graph back to waiting
+    for the user instead of failing the turn.
+    """
+    def decorator(node):
+        async def run_with_deadline(state: State, config: RunnableConfig):
+            deadline = node_deadline(node_name)
+            try:
+                async with asyncio.timeout(deadline):
+                    return await node(state, config)
+            except TimeoutError:
+                logfire.warn("{node} exceeded its {deadline}s deadline", node=node_name, deadline=deadline)
+                get_stream_writer()(DEADLINE_MESSAGE)
+                return dict(fallback)
+        run_with_deadline.__name__ = node.__name__
+        return run_with_deadline
+    return decorator
+
+@with_deadline("gather_information", {"user_requirements": None})
+async def gather_info_node(state: State, config: RunnableConfig) -> Dict[str, str]:
     """
     Node to gather information from the user.
     """
     user_input = state.get("user_input", "")
 
-    writer = get_stream_writer()
-
-    data: Dict[str, str] = {}
+    writer = TimedWriter("gather_information", get_stream_writer())
 
     message_history: list[ModelMessage] = []
     for message_row in state['messages']:
         message_history.extend(ModelMessagesTypeAdapter.validate_json(message_row))
 
-    async with gather_information_agent.iter(user_input, message_history=message_history) as run:
-        async for node in run:
-            if isinstance(node, End):
-                data = node.data.output
-            elif Agent.is_model_request_node(node):
-                async with node.stream(run.ctx) as request_stream:
-                    await process_stream(request_stream, writer)
+    with bind_run_context(config):
+        result = await cached_agent_run(
+            "gather_information",
+            gather_information_agent,
+            writer,
+            (DesiredAppointment,),
+            user_prompt=user_input,
+            message_history=message_history
+        )
+
+    return {
+        "user_requirements": result.output,
+        "messages": [result.new_messages_json()]
+    }
 
+async def _suggestion_update(user_requirement: DesiredAppointment, thread_id: str | None, config: RunnableConfig, writer) -> dict:
+    """
+    Offer the nearest open slots in the same answer instead of another round of questions.
+    """
+    with bind_run_context(config):
+        try:
+            suggestions = await manager_pool.call(nearest_slots, user_requirement, thread_id)
+        except Exception as e:
+            logfire.warn("Could not suggest slots: {error}", error=str(e))
+            suggestions = []
+        text = format_suggestions(suggestions)
+    writer(text)
     return {
-        "user_requirements": data,
-        "messages": [run.result.new_messages_json()]
+        "suggested_slots": suggestions,
+        "message": ModelMessagesTypeAdapter.dump_json([ModelResponse(parts=[TextPart(content=text.strip())])]),
     }
 
-async def calendar_availability_node(state: State) -> Dict[str, str]:
+@with_deadline("calendar_availability", {"selected_appointment": None})
+async def calendar_availability_node(state: State, config: RunnableConfig) -> Dict[str, str]:
     """
     Node to check calendar availability and book appointments.
     """
     user_requirement = state["user_requirements"]
     user_input = state["user_input"]
 
-    data = None
+    writer = TimedWriter("calendar_availability", get_stream_writer())
 
     message_history: list[ModelMessage] = []
     for message_row in state['messages']:
         message_history.extend(ModelMessagesTypeAdapter.validate_json(message_row))
 
-    async with calendar_availability_agent.iter(user_prompt=user_input,deps=user_requirement, message_history=message_history) as run:
-        async for node in run:
-            if isinstance(node, End):
-                if isinstance(node.data.output, SelectedAppointment):
-                    data = node.data.output
+    thread_id = config.get("configurable", {}).get("thread_id")
+
+    # Tools look up the tenant calendar from the run context
+    with bind_run_context(config):
+        memo_key = None
+        if isinstance(user_requirement, DesiredAppointment):
+            memo_key = availability_memo.key(tenant_registry.resolve().calendar_id, user_requirement)
+            remembered, slot_id = availability_memo.get(memo_key)
+            # A slot held by another conversation falls through to a fresh search
+            if remembered and slot_id and (not thread_id or slot_leases.hold(slot_id, thread_id)):
+                writer(f"The slot at {user_requirement.time} is available, I'm holding it for you.")
+                return {"selected_appointment": SelectedAppointment(id=slot_id), "messages": []}
+            if remembered and not slot_id:
+                text = f"No slots open on {user_requirement.min_date} at {user_requirement.time}."
+                writer(text)
+                suggestion = await _suggestion_update(user_requirement, thread_id, config, writer)
+                return {
+                    "selected_appointment": None,
+                    "suggested_slots": suggestion["suggested_slots"],
+                    "messages": [
+                        ModelMessagesTypeAdapter.dump_json([ModelResponse(parts=[TextPart(content=text)])]),
+                        suggestion["message"],
+                    ],
+                }
+
+        result = await stream_agent_run(
+            calendar_availability_agent,
+            writer,
+            user_prompt=user_input,
+            deps=user_requirement,
+            message_history=message_history
+        )
+
+    data = result.output if isinstance(result.output, SelectedAppointment) else None
+    if data is not None and (not data.id or data.id.lower() in ("none", "null")):
+        # The model reports a miss as an empty selection
+        data = None
+    if memo_key is not None and data is not None:
+        availability_memo.put(memo_key, data.id)
+    elif memo_key is not None and memo_key[1] == memo_key[2]:
+        # A miss on a single day is remembered too; ranges are listings, not misses
+        availability_memo.put(memo_key, None)
+
+    # Hold the slot while the user gives their contact details; another
+    # conversation may have taken it in the meantime
+    if data is not None and thread_id and not slot_leases.hold(data.id, thread_id):
+        writer("Sorry, that time was just taken by someone else. Would you like to check another time?")
+        data = None
+
+    update = {
+        "selected_appointment": data,
+        "messages": [result.new_messages_json()]
+    }
+    if data is None and isinstance(user_requirement, DesiredAppointment):
+        suggestion = await _suggestion_update(user_requirement, thread_id, config, writer)
+        update["suggested_slots"] = suggestion["suggested_slots"]
+        update["messages"].append(suggestion["message"])
+    return update
+
+def pick_suggested_slot_node(state: State, config: RunnableConfig) -> Dict[str, str]:
+    """
+    Book one of the suggested slots straight away when the user's reply picks it.
+    """
+    suggestions = state.get("suggested_slots") or []
+    with bind_run_context(config):
+        slot = match_suggestion(state.get("user_input", ""), suggestions) if suggestions else None
+
+    thread_id = config.get("configurable", {}).get("thread_id")
+    if slot is not None and thread_id and not slot_leases.hold(slot["id"], thread_id):
+        get_stream_writer()("Sorry, that slot was just taken by someone else. ")
+        slot = None
     return {
-            "selected_appointment": data,
-            "messages": [run.result.new_messages_json()]
-        }
+        "suggested_slots": [],
+        "selected_appointment": SelectedAppointment(id=slot["id"]) if slot is not None else None,
+    }
+
+def suggested_slot_router(state: State) -> str:
+    """
+    Skip gathering the date again when a suggested slot was picked.
+    """
+    if isinstance(state.get("selected_appointment"), SelectedAppointment):
+        return "gather_contact_information"
+    return "gather_information"
 
-async def gather_contact_information_node(state: State) -> Dict[str, str]:
+@with_deadline("gather_contact_information", {"meeting_details": False})
+async def gather_contact_information_node(state: State, config: RunnableConfig) -> Dict[str, str]:
     """
     Node to gather contact information from the user.
     """
@@ -95,50 +305,54 @@ async def gather_contact_information_node(state: State) -> Dict[str, str]:
     user_input = state["user_input"]
 
 
-    writer = get_stream_writer()
-
-    data = {}
+    writer = TimedWriter("gather_contact_information", get_stream_writer())
 
     message_history: list[ModelMessage] = []
     for message_row in state['messages']:
         message_history.extend(ModelMessagesTypeAdapter.validate_json(message_row))
 
-    run = await gather_contact_information_agent.run(
-        user_prompt=user_input,
-        deps=selected_appointment,
-        message_history=message_history
-    )
+    with bind_run_context(config):
+        result = await cached_agent_run(
+            "gather_contact_information",
+            gather_contact_information_agent,
+            writer,
+            (MeetingDetails,),
+            user_prompt=user_input,
+            deps=selected_appointment,
+            message_history=message_history
+        )
 
-    if not isinstance(run.output, MeetingDetails):
-        print(run.output)
-        writer(run.output)
-
-    data = run.output if isinstance(run.output, MeetingDetails) else False
+    data = result.output if isinstance(result.output, MeetingDetails) else False
 
     return {
         "meeting_details": data,
-        "messages": [run.all_messages_json()]
+        "messages": [result.new_messages_json()]
     }
 
-async def set_meeting_details_node(state: State) -> Dict[str, str]:
+@with_deadline("set_meeting_details", {})
+async def set_meeting_details_node(state: State, config: RunnableConfig) -> Dict[str, str]:
     """
     Node to set the meeting details.
     """
     meeting_details = state["meeting_details"]
 
-    writer = get_stream_writer()
+    writer = TimedWriter("set_meeting_details", get_stream_writer())
 
-    
     message_history: list[ModelMessage] = []
     for message_row in state['messages']:
         message_history.extend(ModelMessagesTypeAdapter.validate_json(message_row))
 
-    result = await set_meeting_details_agent.run(deps=meeting_details, message_history=message_history)
-
-    writer(result.output)
+    with bind_run_context(config):
+        result = await stream_agent_run(
+            set_meeting_details_agent,
+            writer,
+            deps=meeting_details,
+            message_history=message_history
+        )
 
+    # The booking's outcome is read from the outbox by the UI, not from the state
     return {
-        "messages": [result.all_messages_json()]
+        "messages": [result.new_messages_json()]
     }
 
 def verify_user_date_node(state: State):
@@ -0,0 +1,275 @@
+import asyncio
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
+
+import dotenv
+import logfire
+
+dotenv.load_dotenv()
+
+# Profiling is opt-in: PROFILE_TURNS=1 turns it on, everything else is a no-op.
+PROFILE_TURNS = os.getenv("PROFILE_TURNS", "").lower() in ("1", "true", "yes")
+# "sample" only writes collapsed stacks, "cprofile" also dumps a pstats file.
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+LOOP_LAG_INTERVAL = float(os.getenv("PROFILE_LOOP_LAG_INTERVAL", "0.02"))
+LOOP_BLOCKED_THRESHOLD = float(os.getenv("PROFILE_LOOP_BLOCKED_THRESHOLD", "0.05"))
+
+_turn_counters: dict[str, int] = defaultdict(int)
+_turn_counters_lock = threading.Lock()
+
+# Turns being profiled by the code running in this context; tasks and blocking
+# calls started from it belong to them, so overlapping turns get their own traces
+_active_timelines: ContextVar[tuple["LoopTimeline", ...]] = ContextVar("profiled_turns", default=())
+_active_turns = 0
+# Thread ident -> turns that own the blocking call running on that thread
+_thread_owners: dict[int, tuple["LoopTimeline", ...]] = {}
+_profiled_loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+_profiled_loops_lock = threading.Lock()
+
+
+def _run_owned(owners: tuple, fn, *args, **kwargs):
+    ident = threading.get_ident()
+    _thread_owners[ident] = owners
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _thread_owners.pop(ident, None)
+
+
+class _ProfiledExecutor(ThreadPoolExecutor):
+    """Default executor that remembers which profiled turns submitted each call"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        owners = tuple(t for t in _active_timelines.get() if t.active)
+        if not owners:
+            return super().submit(fn, *args, **kwargs)
+        return super().submit(_run_owned, owners, fn, *args, **kwargs)
+
+
+def _install(loop: asyncio.AbstractEventLoop):
+    """
+    Install, once per loop, a task factory that hands new tasks to the turns
+    of the context creating them. Swapping factories per turn breaks as soon
+    as turns overlap on one loop (batch mode), so it is never restored.
+    """
+    with _profiled_loops_lock:
+        if loop in _profiled_loops:
+            return
+        _profiled_loops.add(loop)
+    previous_factory = loop.get_task_factory()
+
+    def task_factory(loop, coro, **kwargs):
+        if previous_factory is not None:
+            task = previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        for timeline in _active_timelines.get():
+            if timeline.active:
+                timeline.add_task(task, coro)
+        return task
+
+    loop.set_task_factory(task_factory)
+    # asyncio.to_thread runs on the default executor; only replace it before it is created
+    if getattr(loop, "_default_executor", None) is None:
+        loop.set_default_executor(_ProfiledExecutor(thread_name_prefix="asyncio"))
+
+
+class StackSampler:
+    """
+    Periodically sample the stacks of the threads running a turn's code and
+    count them in the collapsed format understood by flamegraph.pl / speedscope.
+    Without a timeline every thread in the process is sampled.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL, timeline: "LoopTimeline | None" = None):
+        self.interval = interval
+        self.timeline = timeline
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                # Samplers of other profiled turns are not part of this one
+                if ident == own_ident or names.get(ident, "").startswith("profiling-sampler"):
+                    continue
+                if self.timeline is not None and not self.timeline.owns_thread(ident):
+                    continue
+                self.stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ";".join(reversed(frames))
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class LoopTimeline:
+    """
+    Record the asyncio tasks created during a turn and how long the event loop
+    was blocked, e.g. by synchronous Google Calendar calls inside tools.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.started_at = time.perf_counter()
+        self.tasks: list[dict] = []
+        self.blocked: list[dict] = []
+        self._monitor: asyncio.Task | None = None
+        self.active = False
+        self._loop_thread: int | None = None
+        self._owned_tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+    def _now(self) -> float:
+        return round(time.perf_counter() - self.started_at, 6)
+
+    def add_task(self, task: asyncio.Task, coro):
+        self._owned_tasks.add(task)
+        entry = {
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "start": self._now(),
+            "end": None,
+        }
+        self.tasks.append(entry)
+        task.add_done_callback(lambda _: entry.update(end=self._now()))
+
+    def owns_thread(self, ident: int) -> bool:
+        """Whether the code a thread is running right now belongs to this turn"""
+        if ident == self._loop_thread:
+            return asyncio.current_task(self.loop) in self._owned_tasks
+        owners = _thread_owners.get(ident)
+        if owners is not None:
+            return self in owners
+        # Threads no turn can claim (e.g. other executors) only when nothing else is profiled
+        return _active_turns == 1
+
+    async def _monitor_loop(self):
+        while True:
+            expected = time.perf_counter() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = time.perf_counter() - expected
+            if lag >= LOOP_BLOCKED_THRESHOLD:
+                self.blocked.append({"at": self._now(), "duration": round(lag, 6)})
+
+    def start(self):
+        """Start recording the turn running in the current task; call stop from the same task"""
+        global _active_turns
+        _install(self.loop)
+        self._monitor = self.loop.create_task(self._monitor_loop())
+        self._loop_thread = threading.get_ident()
+        self._owned_tasks.add(asyncio.current_task(self.loop))
+        with _profiled_loops_lock:
+            _active_turns += 1
+        self.active = True
+        _active_timelines.set(_active_timelines.get() + (self,))
+
+    async def stop(self):
+        global _active_turns
+        self.active = False
+        # Not a token reset: the turn may be iterated from a context other than the one it started in
+        _active_timelines.set(tuple(t for t in _active_timelines.get() if t is not self))
+        with _profiled_loops_lock:
+            _active_turns -= 1
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+
+    def to_dict(self) -> dict:
+        return {
+            "duration": self._now(),
+            "loop_blocked_total": round(sum(b["duration"] for b in self.blocked), 6),
+            "loop_blocked": self.blocked,
+            "tasks": self.tasks,
+        }
+
+
+def _next_turn(thread_id: str) -> int:
+    with _turn_counters_lock:
+        _turn_counters[thread_id] += 1
+        return _turn_counters[thread_id]
+
+
+@asynccontextmanager
+async def profile_turn(thread_id: str):
+    """
+    Profile a single conversation turn and write the traces to
+    PROFILE_DIR/<thread_id>/turn-<n>.* once the turn finishes.
+
+    Does nothing unless PROFILE_TURNS is enabled.
+    """
+    if not PROFILE_TURNS:
+        yield
+        return
+
+    turn = _next_turn(thread_id)
+    timeline = LoopTimeline(asyncio.get_running_loop())
+    sampler = StackSampler(timeline=timeline)
+    profiler = cProfile.Profile() if PROFILE_MODE == "cprofile" else None
+
+    timeline.start()
+    sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+        await timeline.stop()
+
+        directory = os.path.join(PROFILE_DIR, thread_id)
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"turn-{turn:04d}")
+
+        sampler.dump(f"{prefix}.collapsed")
+        with open(f"{prefix}.timeline.json", "w") as f:
+            json.dump({"thread_id": thread_id, "turn": turn, **timeline.to_dict()}, f, indent=2)
+        if profiler is not None:
+            profiler.dump_stats(f"{prefix}.prof")
+
+        logfire.info("Turn profile written to {prefix}", prefix=prefix)
+
+
+async def profile_stream(stream: AsyncIterator, thread_id: str) -> AsyncIterator:
+    """
+    Wrap a `graph.astream` iterator so the whole turn is profiled.
+    """
+    async with profile_turn(thread_id):
+        async for chunk in stream:
+            yield chunk
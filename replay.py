@@ -0,0 +1,87 @@
+import os
+
+# Must be set before the agents and the calendar managers are created
+os.environ["TRAFFIC_MODE"] = "replay"
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+
+# Bookings of a replay must not reuse the outcomes stored by the recorded run
+os.environ.setdefault("BOOKING_OUTBOX_PATH", os.path.join(tempfile.mkdtemp(), "booking_outbox.sqlite3"))
+
+from agents import traffic
+from agents.booking_outbox import booking_outbox
+from graph import graph
+from turns import turn_registry
+
+
+async def replay_thread(thread_id: str) -> list[dict]:
+    """
+    Replay a recorded conversation turn by turn against the recorded model
+    and Calendar responses.
+
+    Returns:
+        list: Per turn recorded and replayed latency, and whether the response matched
+    """
+    turns = traffic.replayer.turns(thread_id)
+    traffic.replayer.reset(thread_id)
+    await graph.checkpointer.adelete_thread(thread_id)
+    tenant_id = turns[0]["tenant_id"] if turns else None
+
+    config = {"configurable": {"thread_id": thread_id, "tenant_id": tenant_id}}
+    results = []
+    for number, turn in enumerate(turns, start=1):
+        initial_state = {"messages": [], "user_input": turn["user_input"], "contact_information": {}}
+        started = time.perf_counter()
+        response = ""
+        async for chunk in turn_registry.run(graph, config, turn["user_input"], initial_state):
+            response += chunk
+        results.append({
+            "thread_id": thread_id,
+            "turn": number,
+            "recorded_latency": round(turn["latency"], 4),
+            "replayed_latency": round(time.perf_counter() - started, 4),
+            "matches": response == turn["response"],
+        })
+    return results
+
+
+async def replay(thread_ids: list[str], repeat=1) -> list[dict]:
+    results = []
+    for _ in range(repeat):
+        for thread_id in thread_ids:
+            results.extend(await replay_thread(thread_id))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded conversations offline to benchmark and regression-test the graph")
+    parser.add_argument("threads", nargs="*", help="Thread IDs to replay (defaults to every recording)")
+    parser.add_argument("--repeat", type=int, default=1, help="Times each conversation is replayed")
+    parser.add_argument("--output", help="JSONL file for per-turn results")
+    args = parser.parse_args()
+
+    # Bookings are applied against the recorded Calendar responses too
+    booking_outbox.start()
+    results = asyncio.run(replay(args.threads or traffic.replayer.thread_ids(), repeat=args.repeat))
+    if args.output:
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+
+    latencies = sorted(r["replayed_latency"] for r in results)
+    mismatches = [r for r in results if not r["matches"]]
+    print(json.dumps({
+        "turns": len(results),
+        "mismatches": [f"{r['thread_id']}#{r['turn']}" for r in mismatches],
+        "replayed_latency_p50": round(statistics.median(latencies), 4) if latencies else 0.0,
+        "replayed_latency_p95": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        "recorded_latency_total": round(sum(r["recorded_latency"] for r in results), 4),
+        "replayed_latency_total": round(sum(latencies), 4),
+    }, indent=2))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator
+
+import logfire
+from langgraph.types import Command
+
+from agents import traffic
+from profiling import profile_stream
+
+
+@dataclass
+class _Turn:
+    loop: asyncio.AbstractEventLoop
+    task: asyncio.Task
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class TurnRegistry:
+    """
+    Track the running turn of every thread so a newer input can cancel it,
+    and remember where a cancelled turn has to be rolled back to.
+    """
+
+    def __init__(self, cancel_timeout: float = 5.0):
+        self.cancel_timeout = cancel_timeout
+        self._turns: dict[str, _Turn] = {}
+        self._rollbacks: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    async def _supersede(self, thread_id: str):
+        with self._lock:
+            previous = self._turns.get(thread_id)
+        if previous is None or previous.done.is_set():
+            return
+        logfire.info("Cancelling superseded turn of thread {thread_id}", thread_id=thread_id)
+        # The previous turn may run on another Streamlit session's event loop
+        previous.loop.call_soon_threadsafe(previous.task.cancel)
+        await asyncio.to_thread(previous.done.wait, self.cancel_timeout)
+
+    async def run(self, graph, config: dict, user_input: str, initial_state: dict) -> AsyncIterator[Any]:
+        """
+        Run one turn of a thread, cancelling the turn it supersedes. A turn
+        that does not finish is rolled back: the next turn of the thread starts
+        again from the checkpoint this one started from.
+
+        Args:
+            graph: Compiled graph
+            config (dict): Run config with the thread ID
+            user_input (str): The user's message
+            initial_state (dict): Input used when the thread is not waiting for a message
+        """
+        thread_id = config["configurable"]["thread_id"]
+        await self._supersede(thread_id)
+
+        with self._lock:
+            rollback = self._rollbacks.pop(thread_id, None)
+        if rollback:
+            # The starting checkpoint still holds the cancelled turn's writes (its resume
+            # value and the nodes it finished), which would be replayed instead of this
+            # input. Fork a clean copy of it to start from.
+            config = {**config, "configurable": {**config["configurable"], **rollback}}
+            forked = await graph.aupdate_state(config, None, as_node="__copy__")
+            config = {**config, "configurable": {**config["configurable"], **forked["configurable"]}}
+        elif rollback is not None:
+            # The cancelled turn was the first one, start the thread over
+            await graph.checkpointer.adelete_thread(thread_id)
+
+        snapshot = await graph.aget_state(config)
+        configurable = snapshot.config.get("configurable", {})
+        checkpoint = {
+            "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+            "checkpoint_id": configurable["checkpoint_id"],
+        } if configurable.get("checkpoint_id") else {}
+        if checkpoint:
+            # Pin the turn to this checkpoint so a rollback can fork from it
+            config = {**config, "configurable": {**config["configurable"], **checkpoint}}
+        payload = Command(resume=user_input) if snapshot.next else initial_state
+
+        turn = _Turn(loop=asyncio.get_running_loop(), task=asyncio.current_task())
+        with self._lock:
+            self._turns[thread_id] = turn
+
+        finished = False
+        response = ""
+        started = time.perf_counter()
+        try:
+            async for chunk in profile_stream(graph.astream(payload, stream_mode="custom", config=config), thread_id):
+                response += chunk
+                yield chunk
+            finished = True
+            if traffic.TRAFFIC_MODE == "record":
+                traffic.recorder.record_turn(thread_id, config["configurable"].get("tenant_id"), user_input,
+                                            response, time.perf_counter() - started)
+        finally:
+            with self._lock:
+                if not finished:
+                    self._rollbacks[thread_id] = checkpoint
+                if self._turns.get(thread_id) is turn:
+                    del self._turns[thread_id]
+            turn.done.set()
+
+
+turn_registry = TurnRegistry()
+
+
+async def check_superseded_turn():
+    """
+    Regression check: when a turn is superseded while its second node runs,
+    the next turn must be applied with the new input, not the cancelled one.
+    """
+    from typing import TypedDict
+
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.config import get_stream_writer
+    from langgraph.graph import StateGraph, START
+    from langgraph.types import interrupt
+
+    class CheckState(TypedDict):
+        user_input: str
+        seen: list
+
+    async def slow(state: CheckState):
+        get_stream_writer()(state["user_input"])
+        await asyncio.sleep(0.3)
+        return {"seen": state["seen"] + [state["user_input"]]}
+
+    builder = StateGraph(CheckState)
+    builder.add_node("wait_message", lambda state: {"user_input": interrupt("")})
+    builder.add_node("slow", slow)
+    builder.add_edge(START, "wait_message")
+    builder.add_edge("wait_message", "slow")
+    builder.add_edge("slow", "wait_message")
+    graph = builder.compile(checkpointer=MemorySaver())
+    registry = TurnRegistry()
+    config = {"configurable": {"thread_id": "check"}}
+    initial_state = {"user_input": "", "seen": []}
+
+    async def turn(user_input: str) -> list:
+        try:
+            return [chunk async for chunk in registry.run(graph, config, user_input, initial_state)]
+        except asyncio.CancelledError:
+            return ["cancelled"]
+
+    await turn("start")
+    superseded = asyncio.create_task(turn("a"))
+    await asyncio.sleep(0.1)
+    seen_by_next_node = await turn("b")
+    await superseded
+    values = (await graph.aget_state(config)).values
+    assert seen_by_next_node == ["b"], seen_by_next_node
+    assert values["user_input"] == "b" and values["seen"] == ["b"], values
+    print("Superseding input applied:", values)
+
+
+if __name__ == "__main__":
+    asyncio.run(check_superseded_turn())
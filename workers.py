@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import itertools
+import multiprocessing
+import os
+import threading
+from typing import AsyncIterator
+
+import dotenv
+import logfire
+
+dotenv.load_dotenv()
+
+# Message kinds sent back by the workers
+CHUNK = "chunk"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+
+
+def _worker_main(index: int, requests, responses):
+    """Entry point of a worker process: run turns sent by the dispatcher and stream their output back"""
+    # Bookings and calendar watches are handled by the dispatcher's process
+    from graph import graph
+    from turns import turn_registry
+
+    async def run_turn(request_id: int, config: dict, user_input: str):
+        initial_state = {"messages": [], "user_input": user_input, "contact_information": {}}
+        try:
+            async for chunk in turn_registry.run(graph, config, user_input, initial_state):
+                responses.put((request_id, CHUNK, chunk))
+        except asyncio.CancelledError:
+            # Superseded by a newer turn of the same thread
+            responses.put((request_id, CANCELLED, None))
+            return
+        except Exception as e:
+            logfire.error("Turn failed in worker {index}: {error}", index=index, error=str(e))
+            responses.put((request_id, ERROR, str(e)))
+            return
+        responses.put((request_id, DONE, None))
+
+    async def serve():
+        running = set()
+        while True:
+            request = await asyncio.to_thread(requests.get)
+            if request is None:
+                break
+            task = asyncio.create_task(run_turn(*request))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        await asyncio.gather(*running, return_exceptions=True)
+
+    asyncio.run(serve())
+
+
+class Dispatcher:
+    def __init__(self, workers: int):
+        """
+        Run the graph in several worker processes. Every turn of a thread goes
+        to the same worker, so a newer turn can cancel the one it supersedes;
+        checkpoints, Calendar caches and slot leases live in SQLite files
+        shared by all the workers, so any of them can take over a thread.
+
+        Args:
+            workers (int): Number of worker processes
+        """
+        if os.getenv("CHECKPOINT_STORE") != "sqlite" or not os.getenv("SHARED_STATE_PATH"):
+            raise Exception("Worker processes need CHECKPOINT_STORE=sqlite and SHARED_STATE_PATH")
+        self._context = multiprocessing.get_context("spawn")
+        self._responses = self._context.Queue()
+        self._requests = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._streams: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        for index in range(workers):
+            self._start_worker(index)
+        threading.Thread(target=self._route_responses, name="dispatcher", daemon=True).start()
+
+    @classmethod
+    def from_env(cls) -> "Dispatcher | None":
+        """Dispatcher with GRAPH_WORKERS processes, or None to run the graph in this process"""
+        workers = int(os.getenv("GRAPH_WORKERS", "0"))
+        return cls(workers) if workers > 0 else None
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self._requests[index], self._responses),
+            name=f"graph-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def worker_for(self, thread_id: str) -> int:
+        """Index of the worker that runs a thread, stable across restarts"""
+        digest = hashlib.blake2b(thread_id.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % len(self._processes)
+
+    def _route_responses(self):
+        while True:
+            request_id, kind, payload = self._responses.get()
+            with self._lock:
+                stream = self._streams.get(request_id)
+            if stream is not None:
+                loop, messages = stream
+                loop.call_soon_threadsafe(messages.put_nowait, (kind, payload))
+
+    async def run(self, config: dict, user_input: str) -> AsyncIterator[str]:
+        """
+        Run one turn of a thread on its worker, streaming the output.
+
+        Args:
+            config (dict): Run config with the thread ID
+            user_input (str): The user's message
+        """
+        index = self.worker_for(config["configurable"]["thread_id"])
+        with self._lock:
+            if not self._processes[index].is_alive():
+                logfire.warn("Graph worker {index} exited, restarting it", index=index)
+                self._start_worker(index)
+            process = self._processes[index]
+            request_id = next(self._ids)
+            messages = asyncio.Queue()
+            self._streams[request_id] = (asyncio.get_running_loop(), messages)
+
+        try:
+            self._requests[index].put((request_id, config, user_input))
+            while True:
+                try:
+                    kind, payload = await asyncio.wait_for(messages.get(), timeout=1.0)
+                except TimeoutError:
+                    if not process.is_alive():
+                        raise Exception(f"Graph worker {index} exited during the turn")
+                    continue
+                if kind == CHUNK:
+                    yield payload
+                elif kind == DONE:
+                    return
+                elif kind == CANCELLED:
+                    raise asyncio.CancelledError()
+                else:
+                    raise Exception(payload)
+        finally:
+            with self._lock:
+                self._streams.pop(request_id, None)
+
+    def stop(self):
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=10)